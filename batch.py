@@ -0,0 +1,148 @@
+import argparse
+import csv
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from cast_graph import cast_graph
+from matching import discover_movie, genre_names
+
+# number of queries matched at the same time
+BATCH_WORKERS = 8
+
+# query fields, with the column names of a recent_searches export as aliases
+QUERY_FIELDS = {
+    'genre': ('genre', 'category'),
+    'year': ('year', 'release_year'),
+    'duration': ('duration',),
+    'actor': ('actor', 'cast'),
+}
+
+# Method to normalize one input row into a query
+def parse_query(row):
+
+    """
+    Normalize an input row into a matching query. Empty values mean "any".
+    Args:
+        row (dict): A CSV row or JSON object.
+    Returns:
+        dict: The query's genre, year, duration and actor.
+    """
+
+    query = {}
+    for field, names in QUERY_FIELDS.items():
+        value = next((row[name] for name in names if row.get(name) not in (None, '')), None)
+        query[field] = value
+
+    return query
+
+# Method to read queries from a CSV or JSONL file
+def read_queries(path):
+
+    """
+    Stream the queries of a CSV file (with a header row) or a JSONL file,
+    e.g. a recent_searches export made with db.db_export_table.
+    Args:
+        path (str): The input file, '-' for JSONL on stdin.
+    Returns:
+        generator: The queries, one per row.
+    """
+
+    if path == '-':
+        for line in sys.stdin:
+            if line.strip():
+                yield parse_query(json.loads(line))
+        return
+
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                yield parse_query(row)
+        else:
+            for line in f:
+                if line.strip():
+                    yield parse_query(json.loads(line))
+
+# Method to match a single query
+def match_query(query):
+
+    """
+    Run the matching for one query.
+    Args:
+        query (dict): The query's genre, year, duration and actor.
+    Returns:
+        dict: The query with its matched movies, or with the error that stopped it.
+    """
+
+    try:
+        movies = discover_movie(query['genre'], query['year'], query['actor'], query['duration'])
+    except Exception as e:
+        return {'query': query, 'movies': [], 'error': repr(e)}
+
+    return {
+        'query': query,
+        'movies': [{
+            'id': details.get('movie_id'),
+            'title': title,
+            'release_year': details.get('release_year'),
+            'duration': details.get('duration'),
+            'genres': [genre_names[genre_id] for genre_id in details.get('category', []) if genre_id in genre_names],
+            'actors': details.get('actor', []),
+        } for title, details in movies.nodes(data=True)],
+        'error': None,
+    }
+
+# Method to match many queries in parallel
+def run_batch(queries, workers=BATCH_WORKERS):
+
+    """
+    Match queries on a bounded pool of worker threads sharing the TMDB
+    caches. Results are yielded as soon as they are ready, so they may come
+    out of order; each carries the index of its query. At most twice the
+    number of workers queries are read ahead, so the input is streamed.
+    Args:
+        queries (iterable): The queries, as returned by read_queries.
+        workers (int): Number of worker threads.
+    Returns:
+        generator: One result dict per query, with an added 'index'.
+    """
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+
+        for index, query in enumerate(queries):
+            pending[executor.submit(match_query, query)] = index
+
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield {'index': pending.pop(future), **future.result()}
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield {'index': pending.pop(future), **future.result()}
+
+# Run matching for a file of queries from the command line
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Match a CSV/JSONL file of (genre, year, duration, actor) queries and write JSONL results.')
+    parser.add_argument('input', help="CSV or JSONL file of queries, '-' for JSONL on stdin")
+    parser.add_argument('-o', '--output', default='-', help="JSONL output file, '-' for stdout (default)")
+    parser.add_argument('-w', '--workers', type=int, default=BATCH_WORKERS, help=f'number of parallel workers (default {BATCH_WORKERS})')
+    args = parser.parse_args(argv)
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+
+    try:
+        for result in run_batch(read_queries(args.input), args.workers):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+        # Keep the credits fetched during the run for the next one
+        cast_graph.save()
+
+if __name__ == '__main__':
+    main()
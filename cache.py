@@ -0,0 +1,81 @@
+import threading
+import time
+from functools import wraps
+
+# A small in-memory cache whose entries expire after a number of seconds
+class TTLCache:
+
+    """
+    A thread-safe in-memory cache with a time-to-live for every entry.
+    Args:
+        ttl (int): Seconds an entry stays valid.
+        maxsize (int): Maximum number of entries, the oldest are dropped first.
+    """
+
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None:
+                return default
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+            while len(self._data) > self.maxsize:
+                del self._data[next(iter(self._data))]
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+_MISSING = object()
+
+# Decorator that memoizes a function's results in a TTLCache
+def cached(cache):
+
+    """
+    Cache a function's results by its positional arguments. None results
+    (not found / request failed) are not cached so they are retried.
+    Args:
+        cache (TTLCache): The cache to store the results in.
+    Returns:
+        function: The decorator.
+    """
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args):
+            value = cache.get(args, _MISSING)
+            if value is _MISSING:
+                value = func(*args)
+                if value is not None:
+                    cache.set(args, value)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
@@ -0,0 +1,289 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+# where the graph is stored: each save writes a generation directory of .npy
+# arrays plus a json file of actor names, and CURRENT names the live one
+CAST_GRAPH_DIR = 'cast_graph'
+
+# the arrays of a saved graph
+CAST_GRAPH_ARRAYS = ('movie_ids', 'movie_indptr', 'movie_actors', 'actor_ids', 'actor_indptr', 'actor_movies')
+
+# how many billed actors of a movie are kept in the graph
+CAST_PER_MOVIE = 15
+
+# Bipartite actor–movie graph built from the credits we fetch
+class CastGraph:
+
+    """
+    Bipartite graph of movies and the actors billed in them.
+
+    The saved graph is stored in CSR form, once indexed by movie and once by
+    actor, and memory-mapped when loaded so startup is cheap whatever its
+    size. Credits added since the last save live in small in-memory dicts
+    and are merged into the arrays by save().
+
+    Args:
+        directory (str): The directory the graph is saved in.
+    """
+
+    def __init__(self, directory=CAST_GRAPH_DIR):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._new_movies = {}
+        self._new_actor_movies = {}
+        self.actor_names = {}
+        self.load()
+
+    def load(self):
+
+        """
+        Memory-map the saved graph, or start empty if there is none or it is
+        unreadable or inconsistent.
+        """
+
+        with self._lock:
+            arrays, actor_names = self._read()
+
+            self._movie_ids = arrays['movie_ids']
+            self._movie_indptr = arrays['movie_indptr']
+            self._movie_actors = arrays['movie_actors']
+            self._actor_ids = arrays['actor_ids']
+            self._actor_indptr = arrays['actor_indptr']
+            self._actor_movies = arrays['actor_movies']
+            actor_names.update(self.actor_names)
+            self.actor_names = actor_names
+
+    def add_credits(self, movie_id, cast):
+
+        """
+        Add a movie's cast, as found in a TMDB credits response.
+        Args:
+            movie_id (int): The TMDB id of the movie.
+            cast (list): The 'cast' list of the credits response, in billing order.
+        """
+
+        cast = cast[:CAST_PER_MOVIE]
+        actor_ids = tuple(actor['id'] for actor in cast)
+
+        with self._lock:
+            if self.actors_for_movie(movie_id) == list(actor_ids):
+                return
+
+            self._new_movies[movie_id] = actor_ids
+            for actor in cast:
+                self.actor_names[actor['id']] = actor['name']
+                self._new_actor_movies.setdefault(actor['id'], set()).add(movie_id)
+
+    def has_movie(self, movie_id):
+        with self._lock:
+            return movie_id in self._new_movies or self._base_index(self._movie_ids, movie_id) is not None
+
+    def actors_for_movie(self, movie_id):
+
+        """
+        Get the actors of a movie, in billing order.
+        Args:
+            movie_id (int): The TMDB id of the movie.
+        Returns:
+            list: The actor ids, empty if the movie is unknown.
+        """
+
+        with self._lock:
+            if movie_id in self._new_movies:
+                return list(self._new_movies[movie_id])
+
+            index = self._base_index(self._movie_ids, movie_id)
+            if index is None:
+                return []
+
+            return self._movie_actors[self._movie_indptr[index]:self._movie_indptr[index + 1]].tolist()
+
+    def movies_for_actor(self, actor_id):
+
+        """
+        Get the movies an actor is billed in.
+        Args:
+            actor_id (int): The TMDB id of the actor.
+        Returns:
+            set: The movie ids.
+        """
+
+        with self._lock:
+            movies = set(self._new_actor_movies.get(actor_id, ()))
+
+            index = self._base_index(self._actor_ids, actor_id)
+            if index is not None:
+                movies.update(self._actor_movies[self._actor_indptr[index]:self._actor_indptr[index + 1]].tolist())
+
+            # movies re-added since the last save may have dropped the actor
+            return {movie_id for movie_id in movies
+                    if movie_id not in self._new_movies or actor_id in self._new_movies[movie_id]}
+
+    def films_sharing_cast(self, movie_id):
+
+        """
+        Get the movies sharing at least one actor with a movie.
+        Args:
+            movie_id (int): The TMDB id of the movie.
+        Returns:
+            list: (movie id, number of shared actors) pairs, most shared first.
+        """
+
+        shared = {}
+        for actor_id in self.actors_for_movie(movie_id):
+            for other_id in self.movies_for_actor(actor_id):
+                if other_id != movie_id:
+                    shared[other_id] = shared.get(other_id, 0) + 1
+
+        return sorted(shared.items(), key=lambda item: item[1], reverse=True)
+
+    def actors_within_two_hops(self, actor_id):
+
+        """
+        Get the actors who share a movie with an actor.
+        Args:
+            actor_id (int): The TMDB id of the actor.
+        Returns:
+            set: The co-stars' actor ids.
+        """
+
+        costars = set()
+        for movie_id in self.movies_for_actor(actor_id):
+            costars.update(self.actors_for_movie(movie_id))
+
+        costars.discard(actor_id)
+        return costars
+
+    def names(self, actor_ids):
+        return [self.actor_names.get(actor_id, str(actor_id)) for actor_id in actor_ids]
+
+    def save(self):
+
+        """
+        Merge the credits added since the last save into the CSR arrays,
+        write them to disk and memory-map the new files. The arrays are
+        merged with numpy outside the lock, so lookups from search threads
+        only wait for the final swap.
+        Returns:
+            bool: True if there was anything to save.
+        """
+
+        with self._save_lock:
+            with self._lock:
+                if not self._new_movies:
+                    return False
+
+                new_movies = dict(self._new_movies)
+                actor_names = dict(self.actor_names)
+                movie_ids, movie_indptr, movie_actors = self._movie_ids, self._movie_indptr, self._movie_actors
+
+            # Edges of the saved graph, as (movie, billing position, actor) arrays
+            counts = np.diff(movie_indptr)
+            edge_movies = np.repeat(np.asarray(movie_ids), counts)
+            edge_positions = np.arange(len(movie_actors), dtype=np.int64) - np.repeat(np.asarray(movie_indptr[:-1]), counts)
+            edge_actors = np.asarray(movie_actors)
+
+            # Drop the saved edges of movies re-added since, then append the new edges
+            keep = ~np.isin(edge_movies, np.fromiter(new_movies, dtype=np.int64, count=len(new_movies)))
+            new_edges = [(movie_id, position, actor_id)
+                         for movie_id, actor_ids in new_movies.items()
+                         for position, actor_id in enumerate(actor_ids)]
+            added = np.array(new_edges, dtype=np.int64).reshape(-1, 3)
+
+            edge_movies = np.concatenate((edge_movies[keep], added[:, 0]))
+            edge_positions = np.concatenate((edge_positions[keep], added[:, 1]))
+            edge_actors = np.concatenate((edge_actors[keep], added[:, 2]))
+
+            # CSR by movie keeps the billing order, CSR by actor lists movies in id order
+            by_movie = np.lexsort((edge_positions, edge_movies))
+            by_actor = np.lexsort((edge_movies, edge_actors))
+
+            # Write a new generation, then switch CURRENT to it with one atomic rename
+            os.makedirs(self.directory, exist_ok=True)
+            generation = tempfile.mkdtemp(prefix='gen-', dir=self.directory)
+
+            for name, array in (*self._csr('movie', edge_movies[by_movie], edge_actors[by_movie]),
+                                *self._csr('actor', edge_actors[by_actor], edge_movies[by_actor])):
+                np.save(os.path.join(generation, f"{name}.npy"), array)
+
+            with open(os.path.join(generation, 'actor_names.json'), 'w', encoding='utf-8') as f:
+                json.dump(actor_names, f)
+
+            tmp_path = self._path('CURRENT.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(os.path.basename(generation))
+            os.replace(tmp_path, self._path('CURRENT'))
+
+            with self._lock:
+                # keep the credits that were added or changed while writing
+                for movie_id, actor_ids in new_movies.items():
+                    if self._new_movies.get(movie_id) == actor_ids:
+                        del self._new_movies[movie_id]
+
+                self._new_actor_movies = {}
+                for movie_id, actor_ids in self._new_movies.items():
+                    for actor_id in actor_ids:
+                        self._new_actor_movies.setdefault(actor_id, set()).add(movie_id)
+
+                self.load()
+
+            # older generations, and any left by a save that crashed halfway
+            for entry in os.listdir(self.directory):
+                if entry.startswith('gen-') and entry != os.path.basename(generation):
+                    shutil.rmtree(self._path(entry), ignore_errors=True)
+
+            return True
+
+    def _read(self):
+
+        # the arrays and actor names of the current generation, empty if there is none
+        empty = {name: np.zeros(1 if name.endswith('indptr') else 0, dtype=np.int64) for name in CAST_GRAPH_ARRAYS}
+
+        try:
+            with open(self._path('CURRENT'), encoding='utf-8') as f:
+                generation = self._path(f.read().strip())
+
+            arrays = {name: np.load(os.path.join(generation, f"{name}.npy"), mmap_mode='r') for name in CAST_GRAPH_ARRAYS}
+
+            with open(os.path.join(generation, 'actor_names.json'), encoding='utf-8') as f:
+                actor_names = {int(actor_id): name for actor_id, name in json.load(f).items()}
+
+        except FileNotFoundError:
+            return empty, {}
+
+        except (OSError, ValueError) as e:
+            print(f'Cast graph is unreadable, starting empty: {e}')
+            return empty, {}
+
+        for prefix, neighbours in (('movie', 'movie_actors'), ('actor', 'actor_movies')):
+            ids, indptr = arrays[f"{prefix}_ids"], arrays[f"{prefix}_indptr"]
+            if len(indptr) != len(ids) + 1 or indptr[-1] != len(arrays[neighbours]):
+                print(f'Cast graph {prefix} arrays are inconsistent, starting empty')
+                return empty, {}
+
+        return arrays, actor_names
+
+    def _csr(self, prefix, nodes, neighbours):
+        ids, lengths = np.unique(nodes, return_counts=True)
+        indptr = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+        plural = 'actors' if prefix == 'movie' else 'movies'
+        return ((f"{prefix}_ids", ids.astype(np.int64)), (f"{prefix}_indptr", indptr), (f"{prefix}_{plural}", neighbours.astype(np.int64)))
+
+    def _base_index(self, ids, node_id):
+        index = int(np.searchsorted(ids, node_id))
+        if index < len(ids) and ids[index] == node_id:
+            return index
+        return None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+# the graph shared by the whole application, loaded at startup
+cast_graph = CastGraph()
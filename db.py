@@ -1,5 +1,16 @@
+import csv
+import json
 import sqlite3
 
+# number of rows pulled per fetchmany() call when streaming a table
+FETCH_CHUNK_SIZE = 500
+
+# number of raw searches kept per user, older ones live on only in the rollups
+HISTORY_CAP = 50
+
+# raw searches older than this many days are dropped by the compaction job
+HISTORY_RETENTION_DAYS = 30
+
 # create tables: users, recent searches, ratings
 def db_create_tables():
 
@@ -23,6 +34,42 @@ def db_create_tables():
                     search_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (user_id) REFERENCES users(id));''')
 
+    # Create a new table for ratings
+    conn.execute('''CREATE TABLE IF NOT EXISTS ratings
+                    (id INTEGER PRIMARY KEY,
+                    user_id INTEGER,
+                    movie_id INTEGER,
+                    rating REAL,
+                    FOREIGN KEY (user_id) REFERENCES users(id));''')
+
+    # Rollup tables: per-user search counts by genre and by actor
+    genre_rollup_exists = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'search_genre_rollup'").fetchone()[0] > 0
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS search_genre_rollup
+                    (user_id INTEGER,
+                    category TEXT,
+                    searches INTEGER,
+                    last_search TIMESTAMP,
+                    PRIMARY KEY (user_id, category),
+                    FOREIGN KEY (user_id) REFERENCES users(id));''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS search_actor_rollup
+                    (user_id INTEGER,
+                    cast TEXT,
+                    searches INTEGER,
+                    last_search TIMESTAMP,
+                    PRIMARY KEY (user_id, "cast"),
+                    FOREIGN KEY (user_id) REFERENCES users(id));''')
+
+    # Fold searches logged before the rollups existed into them, once
+    if not genre_rollup_exists:
+        db_rebuild_search_rollups(conn)
+
+    # Indexes used by the per-user lookups and the retention purges
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_recent_searches_user ON recent_searches (user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_recent_searches_date ON recent_searches (search_date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ratings_user ON ratings (user_id)')
+
     # Commit the changes and close the connection
     conn.commit()
     conn.close()
@@ -38,27 +85,107 @@ def db_add_user(user_id, moderator=False):
     conn.close()
     return user_id, cursor.rowcount > 0
 
+# normalizes a typed genre or actor name, so 'action' and 'Action' are one search
+def _normalize_search_text(value):
+    if value is None:
+        return None
+    return ' '.join(str(value).split()).title()
+
 # add a recent search for a user in the database
 def db_add_recent_search(user_id, category, release_year, duration, cast):
 
+    category = _normalize_search_text(category)
+    cast = _normalize_search_text(cast)
+
     conn = sqlite3.connect('filmMatchingDB.db')
-    cursor = conn.cursor()
 
-    result = conn.execute("SELECT MAX(id) FROM recent_searches")
-    max_id = result.fetchone()[0]
+    with conn:
+        # an identical search right after the previous one only refreshes its date
+        # compared in SQL so the typed '2010' matches the stored 2010 (column affinity)
+        last = conn.execute('''SELECT id FROM recent_searches
+                               WHERE user_id = ? AND category IS ? AND release_year IS ? AND duration IS ? AND "cast" IS ?
+                               AND id = (SELECT MAX(id) FROM recent_searches WHERE user_id = ?)''',
+                            (user_id, category, release_year, duration, cast, user_id)).fetchone()
+
+        if last is not None:
+            conn.execute("UPDATE recent_searches SET search_date = CURRENT_TIMESTAMP WHERE id = ?", (last[0],))
+            db_touch_search_rollups(conn, user_id, category, cast, 0)
+            new_id = last[0]
+
+        else:
+            result = conn.execute("SELECT MAX(id) FROM recent_searches")
+            max_id = result.fetchone()[0]
+
+            if max_id is None:
+                new_id = 1
+            else:
+                new_id = max_id + 1
+
+            conn.execute("INSERT INTO recent_searches (id, user_id, category, release_year, duration, cast) VALUES (?, ?, ?, ?, ?, ?)",
+                         (new_id, user_id, category, release_year, duration, cast))
+            db_touch_search_rollups(conn, user_id, category, cast, 1)
+
+            # ring buffer: keep only the newest HISTORY_CAP raw searches of the user
+            conn.execute("""DELETE FROM recent_searches WHERE user_id = ? AND id NOT IN
+                            (SELECT id FROM recent_searches WHERE user_id = ? ORDER BY id DESC LIMIT ?)""",
+                         (user_id, user_id, HISTORY_CAP))
 
-    if max_id is None:
-        new_id = 1
-    else:
-        new_id = max_id + 1
-    
-    conn.execute("INSERT INTO recent_searches (id, user_id, category, release_year, duration, cast) VALUES (?, ?, ?, ?, ?, ?)",
-                 (new_id, user_id, category, release_year, duration, cast))
-    
-    conn.commit()
     conn.close()
     return new_id
 
+# adds a search to the user's genre and actor rollups
+def db_touch_search_rollups(conn, user_id, category, cast, searches):
+
+    conn.execute("""INSERT INTO search_genre_rollup (user_id, category, searches, last_search) VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (user_id, category) DO UPDATE SET searches = searches + excluded.searches, last_search = excluded.last_search""",
+                 (user_id, category, searches))
+
+    conn.execute("""INSERT INTO search_actor_rollup (user_id, "cast", searches, last_search) VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (user_id, "cast") DO UPDATE SET searches = searches + excluded.searches, last_search = excluded.last_search""",
+                 (user_id, cast, searches))
+
+# rebuilds the rollups from the raw searches still in recent_searches
+def db_rebuild_search_rollups(conn):
+
+    conn.execute('DELETE FROM search_genre_rollup')
+    conn.execute('DELETE FROM search_actor_rollup')
+
+    conn.execute('''INSERT INTO search_genre_rollup (user_id, category, searches, last_search)
+                    SELECT user_id, category, COUNT(*), MAX(search_date) FROM recent_searches GROUP BY user_id, category''')
+
+    conn.execute('''INSERT INTO search_actor_rollup (user_id, "cast", searches, last_search)
+                    SELECT user_id, "cast", COUNT(*), MAX(search_date) FROM recent_searches GROUP BY user_id, "cast"''')
+
+# deletes the raw searches older than a number of days, in a single statement
+def _delete_searches_older_than(days):
+
+    conn = sqlite3.connect('filmMatchingDB.db')
+
+    with conn:
+        cursor = conn.execute("DELETE FROM recent_searches WHERE search_date < datetime('now', ?)", (f'-{int(days)} days',))
+
+    conn.close()
+    return cursor.rowcount
+
+# drops raw searches older than a number of days, their counts are already in the rollups
+def db_compact_recent_searches(days=HISTORY_RETENTION_DAYS):
+    return _delete_searches_older_than(days)
+
+# get a user's most searched genres and actors from the rollups
+def get_user_search_summary(user_id, limit=5):
+
+    conn = sqlite3.connect('filmMatchingDB.db')
+    cursor = conn.cursor()
+
+    cursor.execute('SELECT category, searches FROM search_genre_rollup WHERE user_id = ? ORDER BY searches DESC, last_search DESC LIMIT ?', (user_id, limit))
+    genres = cursor.fetchall()
+
+    cursor.execute('SELECT "cast", searches FROM search_actor_rollup WHERE user_id = ? ORDER BY searches DESC, last_search DESC LIMIT ?', (user_id, limit))
+    actors = cursor.fetchall()
+
+    conn.close()
+    return genres, actors
+
 
 # Check if a user exists in the database
 def db_user_exists(user_id):
@@ -163,25 +290,41 @@ def db_check_user_mod(user_id):
     else:
         return False
     
-# gets all users in db
-def get_all_users():
+# streams the rows of a query in chunks instead of loading the whole table
+def db_iter_rows(query, params=(), chunk_size=FETCH_CHUNK_SIZE):
 
     conn = sqlite3.connect('filmMatchingDB.db')
     cursor = conn.cursor()
 
-    cursor.execute('SELECT * FROM users')
-    users = cursor.fetchall()
-    return users
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
 
-# gets all recent searches for all users in db
-def get_all_recent_searches():
+# streams all users in db
+def iter_all_users(chunk_size=FETCH_CHUNK_SIZE):
+    return db_iter_rows('SELECT * FROM users', chunk_size=chunk_size)
 
-    conn = sqlite3.connect('filmMatchingDB.db')
-    cursor = conn.cursor()
+# streams all recent searches for all users in db
+def iter_all_recent_searches(chunk_size=FETCH_CHUNK_SIZE):
+    return db_iter_rows('SELECT * FROM recent_searches', chunk_size=chunk_size)
+
+# streams all ratings in db
+def iter_all_ratings(chunk_size=FETCH_CHUNK_SIZE):
+    return db_iter_rows('SELECT * FROM ratings', chunk_size=chunk_size)
 
-    cursor.execute('SELECT * FROM recent_searches')
-    recent_searches = cursor.fetchall()
-    return recent_searches
+# gets all users in db
+def get_all_users():
+    return list(iter_all_users())
+
+# gets all recent searches for all users in db
+def get_all_recent_searches():
+    return list(iter_all_recent_searches())
 
 # get specific user's recent searches
 def get_user_recent_searches(user_id):
@@ -189,18 +332,146 @@ def get_user_recent_searches(user_id):
     conn = sqlite3.connect('filmMatchingDB.db')
     cursor = conn.cursor()
 
-    cursor.execute('SELECT id, category, release_year, duration, cast, search_date FROM recent_searches WHERE user_id = ?', (user_id,))
+    cursor.execute('SELECT id, category, release_year, duration, "cast", search_date FROM recent_searches WHERE user_id = ?', (user_id,))
     user_recent_searches = cursor.fetchall()
 
     conn.close()
     return user_recent_searches
 
+# get the most searched (category, year, duration, cast) combinations of the last days
+def get_popular_searches(limit=20, days=7):
+
+    conn = sqlite3.connect('filmMatchingDB.db')
+    cursor = conn.cursor()
+
+    cursor.execute('''SELECT category, release_year, duration, "cast", COUNT(*) AS searches, MAX(search_date) AS last_search
+                      FROM recent_searches WHERE search_date >= datetime('now', ?)
+                      GROUP BY category, release_year, duration, "cast"
+                      ORDER BY searches DESC, last_search DESC LIMIT ?''', (f'-{int(days)} days', limit))
+    popular_searches = cursor.fetchall()
+
+    conn.close()
+    return popular_searches
+
 # get all ratings from db
 def get_all_ratings():
+    return list(iter_all_ratings())
+
+# streams a table (users, recent_searches or ratings) to a csv or jsonl file
+def db_export_table(table, path, fmt='csv', chunk_size=FETCH_CHUNK_SIZE):
+
+    if table not in ('users', 'recent_searches', 'ratings'):
+        raise ValueError(f"Unknown table: {table}")
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError(f"Unknown export format: {fmt}")
 
     conn = sqlite3.connect('filmMatchingDB.db')
     cursor = conn.cursor()
+    exported = 0
+
+    try:
+        cursor.execute(f'SELECT * FROM {table}')
+        columns = [column[0] for column in cursor.description]
+
+        with open(path, 'w', newline='', encoding='utf-8') as out:
+            if fmt == 'csv':
+                writer = csv.writer(out)
+                writer.writerow(columns)
+
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+
+                if fmt == 'csv':
+                    writer.writerows(rows)
+                else:
+                    out.writelines(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+
+                exported += len(rows)
+    finally:
+        conn.close()
+
+    return exported
+
+# purges searches older than a number of days, in a single statement
+def db_purge_searches_older_than(moderator_id, days):
+
+    if(not db_check_user_mod(moderator_id)):
+        print(f"user {moderator_id} is NOT a moderator")
+        return False
+
+    return _delete_searches_older_than(days)
+
+# loads a set of ids into the connection's temp_ids table, so statements can use
+# IN (SELECT id FROM temp_ids) whatever the number of ids (one ? per id would hit
+# SQLite's bound-parameter limit)
+def _fill_temp_ids(conn, ids):
 
-    cursor.execute('SELECT * FROM ratings')
-    ratings = cursor.fetchall()
-    return ratings
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS temp_ids (id INTEGER PRIMARY KEY)')
+    conn.execute('DELETE FROM temp_ids')
+    conn.executemany('INSERT OR IGNORE INTO temp_ids (id) VALUES (?)', ((id,) for id in ids))
+
+# purges all data (searches, ratings and the user rows) for a set of users in one transaction
+def db_purge_users(moderator_id, user_ids):
+
+    if(not db_check_user_mod(moderator_id)):
+        print(f"user {moderator_id} is NOT a moderator")
+        return False
+
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+
+    conn = sqlite3.connect('filmMatchingDB.db')
+
+    with conn:
+        _fill_temp_ids(conn, user_ids)
+        conn.execute('DELETE FROM recent_searches WHERE user_id IN (SELECT id FROM temp_ids)')
+        conn.execute('DELETE FROM ratings WHERE user_id IN (SELECT id FROM temp_ids)')
+        conn.execute('DELETE FROM search_genre_rollup WHERE user_id IN (SELECT id FROM temp_ids)')
+        conn.execute('DELETE FROM search_actor_rollup WHERE user_id IN (SELECT id FROM temp_ids)')
+        cursor = conn.execute('DELETE FROM users WHERE id IN (SELECT id FROM temp_ids)')
+
+    conn.close()
+    return cursor.rowcount
+
+# deletes a set of searches by id in one transaction
+def db_delete_searches(moderator_id, search_ids):
+
+    if(not db_check_user_mod(moderator_id)):
+        print(f"user {moderator_id} is NOT a moderator")
+        return False
+
+    search_ids = list(search_ids)
+    if not search_ids:
+        return 0
+
+    conn = sqlite3.connect('filmMatchingDB.db')
+
+    with conn:
+        _fill_temp_ids(conn, search_ids)
+        cursor = conn.execute('DELETE FROM recent_searches WHERE id IN (SELECT id FROM temp_ids)')
+
+    conn.close()
+    return cursor.rowcount
+
+# deletes a set of ratings by id in one transaction
+def db_delete_ratings(moderator_id, rating_ids):
+
+    if(not db_check_user_mod(moderator_id)):
+        print(f"user {moderator_id} is NOT a moderator")
+        return False
+
+    rating_ids = list(rating_ids)
+    if not rating_ids:
+        return 0
+
+    conn = sqlite3.connect('filmMatchingDB.db')
+
+    with conn:
+        _fill_temp_ids(conn, rating_ids)
+        cursor = conn.execute('DELETE FROM ratings WHERE id IN (SELECT id FROM temp_ids)')
+
+    conn.close()
+    return cursor.rowcount
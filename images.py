@@ -0,0 +1,197 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import requests
+from PIL import Image, ImageDraw
+
+# small TMDB poster size, plenty for a grid tile
+POSTER_SIZE = 'w185'
+POSTER_BASE_URL = f"https://image.tmdb.org/t/p/{POSTER_SIZE}"
+
+# resized thumbnails are kept on disk between runs
+POSTER_CACHE_DIR = 'poster_cache'
+
+# size of a tile in the collage and number of tiles per row
+THUMB_SIZE = (185, 278)
+COLLAGE_COLUMNS = 5
+COLLAGE_QUALITY = 80
+
+# CPU-bound image work runs in worker processes, created on first use. By then
+# the bot already runs threads, so the workers are started from a forkserver
+# (spawned where there is none) instead of forking the threaded process, which
+# can deadlock a worker on a lock held by another thread
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+_pool = None
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=max(1, min(4, (os.cpu_count() or 1) - 1)),
+                                    mp_context=multiprocessing.get_context(POOL_START_METHOD))
+    return _pool
+
+# Method to get the disk path of a poster's thumbnail
+def thumbnail_path(poster_path):
+
+    """
+    Get the path a poster's thumbnail is cached at.
+    Args:
+        poster_path (str): The TMDB poster path, e.g. '/abc.jpg'.
+    Returns:
+        str: The thumbnail's path on disk.
+    """
+
+    return os.path.join(POSTER_CACHE_DIR, poster_path.strip('/').replace('/', '_'))
+
+# Method to download a small poster
+def download_poster(poster_path):
+
+    """
+    Download a poster in the small TMDB size.
+    Args:
+        poster_path (str): The TMDB poster path.
+    Returns:
+        bytes: The image data, or None if the download failed.
+    """
+
+    response = requests.get(f"{POSTER_BASE_URL}{poster_path}", timeout=10)
+
+    if response.status_code == 200:
+        return response.content
+
+    print(f"Error downloading poster {poster_path} - {response.status_code}")
+    return None
+
+# Method to resize a poster and save it as a thumbnail (runs in a worker process)
+def resize_poster(data, path):
+
+    """
+    Resize a downloaded poster to the tile size and save it on disk.
+    Args:
+        data (bytes): The downloaded image.
+        path (str): Where to save the thumbnail.
+    Returns:
+        str: The thumbnail's path.
+    """
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    image = Image.open(BytesIO(data)).convert('RGB')
+    image.thumbnail(THUMB_SIZE)
+
+    # write to a temporary file first so readers never see half a thumbnail
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    image.save(tmp_path, 'JPEG', quality=COLLAGE_QUALITY)
+    os.replace(tmp_path, path)
+    return path
+
+# Method to resize a poster in the process pool from a worker thread
+def resize_poster_in_pool(data, path):
+
+    """
+    Run resize_poster in the process pool and wait for it, for callers that
+    run in a thread instead of the event loop.
+    Args:
+        data (bytes): The downloaded image.
+        path (str): Where to save the thumbnail.
+    Returns:
+        str: The thumbnail's path.
+    """
+
+    return _get_pool().submit(resize_poster, data, path).result()
+
+# Method to composite thumbnails into one numbered grid (runs in a worker process)
+def compose_collage(paths, columns=COLLAGE_COLUMNS):
+
+    """
+    Composite thumbnails into a grid image, numbering every tile.
+    Args:
+        paths (list): Thumbnail paths in result order; None for a movie without a poster.
+        columns (int): Tiles per row.
+    Returns:
+        bytes: The collage as JPEG data.
+    """
+
+    columns = max(1, min(columns, len(paths)))
+    rows = (len(paths) + columns - 1) // columns
+    width, height = THUMB_SIZE
+
+    collage = Image.new('RGB', (columns * width, rows * height), (30, 30, 30))
+    draw = ImageDraw.Draw(collage)
+
+    for index, path in enumerate(paths):
+        x = (index % columns) * width
+        y = (index // columns) * height
+
+        if path is not None:
+            with Image.open(path) as thumb:
+                collage.paste(thumb, (x + (width - thumb.width) // 2, y + (height - thumb.height) // 2))
+
+        # number badge in the tile's corner, matching the caption lines
+        draw.rectangle((x, y, x + 28, y + 22), fill=(0, 0, 0))
+        draw.text((x + 7, y + 5), str(index + 1), fill=(255, 255, 255))
+
+    output = BytesIO()
+    collage.save(output, 'JPEG', quality=COLLAGE_QUALITY, optimize=True)
+    return output.getvalue()
+
+# Method to get a poster's thumbnail, downloading and resizing it if needed
+async def get_thumbnail(poster_path):
+
+    """
+    Get the cached thumbnail of a poster, downloading it in a thread and
+    resizing it in the process pool the first time.
+    Args:
+        poster_path (str): The TMDB poster path, or None.
+    Returns:
+        str: The thumbnail's path, or None if the movie has no usable poster.
+    """
+
+    if not poster_path:
+        return None
+
+    path = thumbnail_path(poster_path)
+    if os.path.exists(path):
+        return path
+
+    # a failed poster becomes a blank tile instead of failing the whole search
+    try:
+        data = await asyncio.to_thread(download_poster, poster_path)
+    except requests.RequestException as e:
+        print(f"Error downloading poster {poster_path} - {e}")
+        return None
+
+    if data is None:
+        return None
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_pool(), resize_poster, data, path)
+    except OSError as e:
+        print(f"Error resizing poster {poster_path} - {e}")
+        return None
+
+# Method to build one collage image of a search's posters
+async def build_poster_collage(poster_paths):
+
+    """
+    Build a numbered grid image of the given posters.
+    Args:
+        poster_paths (list): TMDB poster paths in result order (None allowed).
+    Returns:
+        BytesIO: The collage, ready to upload, or None if no poster was found.
+    """
+
+    paths = await asyncio.gather(*(get_thumbnail(poster_path) for poster_path in poster_paths))
+    if not any(paths):
+        return None
+
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(_get_pool(), compose_collage, list(paths))
+
+    image = BytesIO(data)
+    image.name = "movie_posters.jpg"
+    return image
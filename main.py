@@ -1,15 +1,23 @@
+import asyncio
+import datetime
 import io
+import os
 from typing import Final
 
 import update as update
 from telegram import InputMediaPhoto, InlineKeyboardButton, InlineKeyboardMarkup
-import networkx as nx
-from collections import defaultdict
 import db
 from utils import *
+from cache import TTLCache
+from matching import genres_dict, genre_names, discover_movie
+from tasks import SearchTaskManager
+from render import START_KEYBOARD, render_collage_caption, render_movie_list_pages, page_keyboard
+from cast_graph import cast_graph
+from sender import OutboundScheduler, BULK
+from images import build_poster_collage, download_poster, resize_poster_in_pool, thumbnail_path
 from tmdbv3api import Movie
 from secret import TOKEN, TMDB_API_KEY, BOT_USERNAME
-# pip install python-telegram-bot
+# pip install "python-telegram-bot[job-queue]"
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
 
@@ -21,8 +29,27 @@ db.db_create_tables() # create the DB tables
 user_preferences = {}
 userp = []
 
-# createa a genres dictionary with genre name and its integer value
-genres_dict = create_genre_dictionary()
+# sends all replies within Telegram's flood limits, started with the application
+scheduler = OutboundScheduler()
+
+# runs the searches in the background, one per chat; a cancelled search's
+# results that are still queued are dropped
+search_manager = SearchTaskManager(on_cancel=lambda chat_id: scheduler.discard(chat_id, 'search'))
+
+# the movie lists that can be paged, and their rendered pages by option
+MOVIE_LISTS = ('upcoming', 'top_rated')
+MOVIE_LIST_CACHE_TTL = 60 * 60
+movie_list_cache = TTLCache(MOVIE_LIST_CACHE_TTL)
+
+# prewarmer settings: how many popular searches to warm, how far back to look,
+# the TMDB calls per second it may make and the off-peak time it runs at
+PREWARM_SEARCHES = 20
+PREWARM_DAYS = 7
+PREWARM_TMDB_RATE = 1
+PREWARM_TIME = datetime.time(hour=4)
+
+# seconds between writes of newly fetched credits to the cast graph on disk
+CAST_GRAPH_SAVE_INTERVAL = 10 * 60
 
 
 # Method to rate a movie using the TMDB API
@@ -89,145 +116,123 @@ def get_movies_by_options(option):
     movies_list = []
     
     # Extract relevant movie details and create a list of movie names
-    i = 0
-    while i < 20:
-        if(movies[i]['original_language'] == 'en'): #add a movie only if it's in english
+    for movie in movies[:20]:
+        if(movie['original_language'] == 'en'): #add a movie only if it's in english
 
+            runtime = get_film_runtime(movie['id']) or 0
             movie_details = {
-            'title': movies[i]['original_title'],
-            'genres': [genres_dict[genre_id] for genre_id in movies[i]['genre_ids']],
-            'release_year': movies[i]['release_date'][:4],
-            'duration': f"{movies[i]['runtime'] // 60}h {movies[i]['runtime'] % 60}m",
-            'actors': get_film_actors(get_movie_id(movies[i]['title']))
+            'id': movie['id'],
+            'title': movie['original_title'],
+            'genres': [genre_names[genre_id] for genre_id in movie['genre_ids'] if genre_id in genre_names],
+            'release_year': movie['release_date'][:4],
+            'duration': f"{runtime // 60}h {runtime % 60}m",
+            'actors': get_film_actors(movie['id'])
             }
 
             movies_list.append(movie_details)
-            
-        i += 1
 
     return movies_list
 
-# method to calculate similarity between movies based on genres, release year, cast and duration
-def calculate_similarity(target_params, movie_params):
+# method to get the rendered pages of the top rated or upcoming list
+def get_movie_list_pages(option):
 
     """
-    Calculate the similarity score between two sets of movie parameters.
+    Get the pages of a movie list, rendering them once per cache period.
 
-    :param target_params: Parameters of the target movie.
-    :param movie_params: Parameters of the movie to compare.
-    :return: The similarity score.
+    :param option: The option for fetching movies (e.g., 'top_rated', 'upcoming').
+    :return: A list with the text of every page.
     """
-        
-    # Each parameter is a set of values
-    genre_diff = len(target_params[0].intersection(movie_params[0]))
-    year_diff = abs(target_params[1] - movie_params[1])
-    actor_diff = len(target_params[2].intersection(movie_params[2]))
-    duration_diff = abs(target_params[3] - movie_params[3])
 
-    # Calculate a weighted similarity score
-    similarity_score = genre_diff + year_diff + actor_diff + duration_diff
+    pages = movie_list_cache.get(option)
+    if pages is None:
+        pages = render_movie_list_pages(get_movies_by_options(option))
+        movie_list_cache.set(option, pages)
 
-    return similarity_score
+    return pages
 
-# Method to discover movies based on user-defined parameters
-def discover_movie(genre_name=None, release_year=None, actor_name=None, duration=None):
+# Method to reply with the first page of a movie list
+async def send_movie_list(message, option):
+    pages = await asyncio.to_thread(get_movie_list_pages, option)
+    scheduler.send_text(message.chat.id, pages[0], priority=BULK, reply_markup=page_keyboard(option, 0, len(pages)))
 
-    """
-    Discover movies based on user-defined parameters.
+# Method to precompute the results of the most popular searches
+def prewarm_popular_searches(limit=PREWARM_SEARCHES, days=PREWARM_DAYS, rate=PREWARM_TMDB_RATE):
 
-    :param genre_name: The genre of the movie.
-    :param release_year: The release year of the movie.
-    :param actor_name: The actor's name in the movie.
-    :param duration: The duration of the movie.
-    :return: A network graph containing movie information.
     """
-        
-    total_films_added = 0
-    NUMBER_OF_FILMS_TO_ADD = 10
-
-    DISCOVER_URL = "https://api.themoviedb.org/3/discover/movie"
-
-    # Initialize a network graph to store movie information
-    filmGraph = nx.Graph()
-    actor_id = get_actor_id(actor_name) if actor_name is not None else None
-    genre_id = genres_dict.get(genre_name) if genre_name is not None else None
-
-    # Iterate through multiple pages of results
-    page = 1
-    while total_films_added < NUMBER_OF_FILMS_TO_ADD and page <= 500:
-
-        # Prepare parameters for the TMDB API request
-        params = {
-            "api_key": TMDB_API_KEY,
-            "primary_release_year": release_year,
-            "with_genres": genre_id,
-            "with_cast": actor_id,
-            "sort_by": "popularity.desc",
-            "include_adult": False,
-            "include_video": False,
-            "runtime.gte": duration,
-            "page": page
-        }
-
-        # Make the request to TMDB API
-        response = requests.get(DISCOVER_URL, params=params)
-
-        if response.status_code == 200:
-            movies = response.json()["results"]
-            for movie in movies:
-                if total_films_added >= NUMBER_OF_FILMS_TO_ADD:
-                    break
-                
-                # Extract movie details and add to the graph
-                film_id = get_movie_id(movie['title'])
-                film_runtime = get_film_runtime(film_id)
-                duration_formatted = f"{film_runtime // 60}h {film_runtime % 60}m"
-
-                filmGraph.add_node(
-                    movie['title'],
-                    category=movie['genre_ids'],
-                    release_year=movie['release_date'][:4],
-                    duration=duration_formatted,
-                    actor=get_film_actors(film_id)
-                )
-
-                total_films_added += 1
+    Run the most frequent recent searches ahead of demand so that their
+    discover results, film details and poster thumbnails are already cached.
+    Every TMDB call it triggers, including the parallel discover queries,
+    goes through one throttle of `rate` calls per second.
+
+    :param limit: How many search combinations to warm.
+    :param days: How many days of search history to mine.
+    :param rate: TMDB calls allowed per second.
+    :return: The number of searches warmed.
+    """
 
-        else:
-            print(f"Error fetching data from API - {response.status_code}")
-            print(response.text)
-            break
+    warmed = 0
+    throttle = Throttle(rate)
+    token = tmdb_throttle.set(throttle)
+
+    try:
+        for category, release_year, duration, cast, searches, last_search in db.get_popular_searches(limit, days):
+            # refresh the cached result so it outlives the next day's searches
+            movies = discover_movie(category, release_year, cast, duration, refresh=True)
+
+            for title, details in movies.nodes(data=True):
+                poster_path = details.get('poster_path')
+                if poster_path and not os.path.exists(thumbnail_path(poster_path)):
+                    throttle.wait()
+                    data = download_poster(poster_path)
+                    if data is not None:
+                        resize_poster_in_pool(data, thumbnail_path(poster_path))
+
+            warmed += 1
+    finally:
+        tmdb_throttle.reset(token)
 
-        page += 1
+    return warmed
 
-    # If we have less than 10 movies, fill the list with closest matches
-    if total_films_added < NUMBER_OF_FILMS_TO_ADD:
-        movie_similarity = defaultdict(list)
-        target_params = (genre_id, release_year, actor_id, duration)
+# job to write the credits fetched since the last save to the cast graph on disk
+async def save_cast_graph_job(context: ContextTypes.DEFAULT_TYPE):
+    await asyncio.to_thread(cast_graph.save)
 
-        for movie in filmGraph.nodes(data=True):
-            params = (
-                set(movie[1]['category']),
-                int(movie[1]['release_year']),
-                set(movie[1]['actor']),
-                movie[1]['duration']
-            )
+# job to prewarm the caches off-peak, without blocking the event loop
+async def prewarm_job(context: ContextTypes.DEFAULT_TYPE):
+    warmed = await asyncio.to_thread(prewarm_popular_searches)
+    print(f'Prewarmed {warmed} popular searches')
 
-            similarity = calculate_similarity(target_params, params) 
-            movie_similarity[similarity].append(movie)
 
-        # Find closest movies and add them to the result
-        sorted_similarities = sorted(movie_similarity.keys(), reverse=True)
-        for similarity in sorted_similarities:
-            for movie in movie_similarity[similarity]:
-                if total_films_added >= NUMBER_OF_FILMS_TO_ADD:
-                    break
+# Method to search movies and reply with a collage of their posters
+async def send_search_results(message, genre_name, release_year, actor_name, duration, cancel_event):
+
+    """
+    Search movies and send their posters as one numbered collage with a
+    compact caption. The blocking TMDB calls run in threads so the event
+    loop stays free.
+
+    :param message: The message to reply to.
+    :param genre_name: The genre of the movie.
+    :param release_year: The release year of the movie.
+    :param actor_name: The actor's name in the movie.
+    :param duration: The duration of the movie.
+    :param cancel_event: threading.Event set once the search is cancelled.
+    """
+
+    movies = await asyncio.to_thread(discover_movie, genre_name, release_year, actor_name, duration, cancel_event)
 
-                filmGraph.add_node(movie[0], **movie[1])
-                total_films_added += 1
+    if not movies:
+        scheduler.send_text(message.chat.id, 'No movies found.', tag='search')
+        return
 
-    return filmGraph
+    results = list(movies.nodes(data=True))
+    caption = render_collage_caption(results)
+    collage = await build_poster_collage([details.get('poster_path') for title, details in results])
 
+    if collage is None:
+        scheduler.send_text(message.chat.id, caption, tag='search')
+    else:
+        scheduler.send_photo(message.chat.id, collage, caption=caption, tag='search')
 
 
 async def inline_button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -238,50 +243,71 @@ async def inline_button_callback(update: Update, context: ContextTypes.DEFAULT_T
     option = query.data
 
     if option == "upcoming":
-        fof = get_movies_by_options('upcoming')
-        await query.message.reply_text(fof)
+        await send_movie_list(query.message, 'upcoming')
+
+    elif option.startswith("page:"):
+        # User is paging through a movie list; callback data can be forged,
+        # so anything but a known list and a page number is ignored
+        parts = option.split(':')
+        if len(parts) != 3 or parts[1] not in MOVIE_LISTS or not parts[2].isdigit():
+            return
+
+        list_name = parts[1]
+        pages = await asyncio.to_thread(get_movie_list_pages, list_name)
+        page = min(int(parts[2]), len(pages) - 1)
+        keyboard = page_keyboard(list_name, page, len(pages))
+
+        # Telegram rejects an edit that changes neither the text nor the keyboard
+        if pages[page].strip() != query.message.text or keyboard != query.message.reply_markup:
+            await query.edit_message_text(pages[page], reply_markup=keyboard)
 
     elif option == "ratemovies":
-        await query.message.reply_text("What's the name of the movie you want to rate?")
+        scheduler.send_text(query.message.chat.id, "What's the name of the movie you want to rate?")
         context.user_data['rating_movie_name'] = True
         context.user_data.pop('rating_movie_number_input', None)
 
     elif option == "searchmovie":
-        await query.message.reply_text("Type movie to start the search!")
+        scheduler.send_text(query.message.chat.id, "Type movie to start the search!")
 
     elif option == "topmovies":
-        fof = get_movies_by_options('top_rated')
-        await query.message.reply_text(fof)
+        await send_movie_list(query.message, 'top_rated')
 
     elif option == 'randommovies':
-        genre_dict = {v: k for k, v in genres_dict.items()}
-        movies = discover_movie(None, None, None, None)
-        if movies:
-            for movie in movies.nodes(data=True):
-                title = movie[0]
-                details = movie[1]
-                release_year = details.get('release_year', 'Unknown')
-                duration = details.get('duration', 'Unknown')
-                genre_names = ', '.join(
-                    [genre_dict.get(category) for category in details['category'] if category in genre_dict])
-
-                actors = ', '.join(details['actor'])
-                poster_url = get_movie_image_url(TMDB_API_KEY, title)
-                response = requests.get(poster_url)
-                image = io.BytesIO(response.content)
-                image.name = "movie_poster.jpg"
-
-                details_str = f"Release Year: {release_year}\nDuration: {duration}\nGenres: {genre_names}\nActors: {actors}"
-                await query.message.reply_photo(photo=image, caption=details_str)
-        else:
-            response = 'No movies found.'
+        message = query.message
+        search_manager.submit(
+            message.chat.id,
+            lambda cancel_event: send_search_results(message, None, None, None, None, cancel_event),
+            on_timeout=lambda: scheduler.send_text(message.chat.id, 'The search took too long, please try again.'),
+            on_error=lambda: scheduler.send_text(message.chat.id, 'Something went wrong with the search, please try again.'))
 
     elif option == "history":
-        history = db.get_user_recent_searches(query.message.chat.id)
-        sos = ""
-        for h in history:
-            sos = sos + " " + h[2]
-        await query.message.reply_text(sos)
+        scheduler.send_text(query.message.chat.id, format_search_history(query.message.chat.id))
+
+# method to build the history reply from the user's search rollups
+def format_search_history(user_id):
+
+    """
+    Build a short summary of a user's searches, read from the rollup tables
+    so the reply stays small no matter how many searches the user made.
+
+    :param user_id: The Telegram chat id of the user.
+    :return: The history message text.
+    """
+
+    genres, actors = db.get_user_search_summary(user_id)
+
+    if not genres and not actors:
+        return "You haven't searched for any movies yet."
+
+    genres_str = ', '.join(f"{category} ({searches})" for category, searches in genres)
+    actors_str = ', '.join(f"{cast} ({searches})" for cast, searches in actors)
+
+    return f"Your top genres: {genres_str}\nYour top actors: {actors_str}"
+
+# job to drop raw searches past the retention window
+async def compact_history_job(context: ContextTypes.DEFAULT_TYPE):
+    removed = db.db_compact_recent_searches()
+    print(f'Compacted {removed} old searches')
 
 # use the /start command
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -293,53 +319,33 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     :param context: The context object containing user context data.
     """
     
-    # Create an inline keyboard for user interaction
-    keyboard = [
-        [InlineKeyboardButton("Upcoming", callback_data="upcoming")],
-        [InlineKeyboardButton("Top Movies", callback_data="topmovies")],
-        [InlineKeyboardButton("History", callback_data="history")],
-        [InlineKeyboardButton("Random Movies", callback_data="randommovies")],
-        [InlineKeyboardButton("Rate Movies", callback_data="ratemovies")],
-        [InlineKeyboardButton("Search Movie", callback_data="searchmovie")]
-    ]
-
-    # Build the reply markup
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     # Send a welcome message to the user
-    await update.message.reply_text(
+    scheduler.send_text(update.message.chat.id,
         "Hello there! I'm a bot. What's up?",
-        reply_markup=reply_markup
+        reply_markup=START_KEYBOARD
     )
 
 
 # use the /help command
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text('Try typing anything and I will do my best to respond!')
+    scheduler.send_text(update.message.chat.id, 'Try typing anything and I will do my best to respond!')
 
 
 # use the /custom command
 async def topmovies_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    fof = get_movies_by_options('top_rated')
-    await update.message.reply_text(fof)
+    await send_movie_list(update.message, 'top_rated')
 
 # use the /about command
 async def About_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text('Hi, Im a bot that searches for you the movies that will suit you best')
+    scheduler.send_text(update.message.chat.id, 'Hi, Im a bot that searches for you the movies that will suit you best')
 
 # use the /history command
 async def History_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    history = db.get_user_recent_searches(update.message.chat.id)
-    sos = ""
-    for h in history:
-        sos = sos +" " + h[2]
-
-    await update.message.reply_text(sos)
+    scheduler.send_text(update.message.chat.id, format_search_history(update.message.chat.id))
 
 # use the /upcoming command
 async def UpComing_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    fof = get_movies_by_options('upcoming')
-    await update.message.reply_text(fof)
+    await send_movie_list(update.message, 'upcoming')
 
 
 def handle_response(text: str) -> str:
@@ -372,7 +378,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['rating_movie_name_input'] = movie_name
         print(context.user_data.get('rating_movie_name_input'))
         # Save the movie name
-        await update.message.reply_text("Type a number between 1 and 10 to rate this movie.")
+        scheduler.send_text(update.message.chat.id, "Type a number between 1 and 10 to rate this movie.")
 
     elif context.user_data.get('rating_movie_name_input'):
         # User entered a rating for a movie
@@ -381,7 +387,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # ensure the rating is a number between 1 and 10
         if rating.isdigit() and 1 <= int(rating) <= 10:
             # Clear the saved input
-            await update.message.reply_text(
+            scheduler.send_text(update.message.chat.id,
                 f"You rated '{context.user_data['rating_movie_name_input']}' with a rating of {rating}.")
             rate_movie(context.user_data['rating_movie_name_input'], float(rating))
             # context.user_data.pop('rating_movie_name_input')
@@ -390,7 +396,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             print(context.user_data.get('rating_movie_name_input'))
 
         else:
-            await update.message.reply_text("Please provide a valid rating between 1 and 10.")
+            scheduler.send_text(update.message.chat.id, "Please provide a valid rating between 1 and 10.")
 
         # Clear the saved data
         # context.user_data.pop('rating_movie_name_input')
@@ -401,11 +407,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_pref = user_preferences.get(user_id, {})
 
         if text.lower() == 'movie':
-            # User wants to search for a movie
+            # User wants to search for a movie, dropping any search still running
 
+            search_manager.cancel(user_id)
             user_pref['movie_search'] = 'genre'
             user_preferences[user_id] = user_pref
-            await update.message.reply_text('Please enter the genre of the movie:')
+            scheduler.send_text(update.message.chat.id, 'Please enter the genre of the movie:')
 
         elif user_pref.get('movie_search'):
             # User is in the process of movie search
@@ -415,17 +422,17 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if search_step == 'genre': # User is selecting the genre of the movie
                 user_pref['genre'] = text
                 user_pref['movie_search'] = 'year'
-                await update.message.reply_text('Please enter the release year:')
+                scheduler.send_text(update.message.chat.id, 'Please enter the release year:')
 
             elif search_step == 'year': # User is selecting the release year of the movie
                 user_pref['year'] = text
                 user_pref['movie_search'] = 'duration'
-                await update.message.reply_text('Please enter the duration (in minutes):')
+                scheduler.send_text(update.message.chat.id, 'Please enter the duration (in minutes):')
 
             elif search_step == 'duration': # User is selecting the duration of the movie
                 user_pref['duration'] = text
                 user_pref['movie_search'] = 'actor'
-                await update.message.reply_text('Please enter the actor:')
+                scheduler.send_text(update.message.chat.id, 'Please enter the actor:')
 
             elif search_step == 'actor': # User is selecting the actor of the movie
                 user_pref['actor'] = text
@@ -444,36 +451,38 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 # insert user's recent search 
                 sos = db.db_add_recent_search(user_id, genre_name, release_year, duration, actor_name)
 
-                # Fetch movies and their image URLs
-                genre_dict = {v: k for k, v in genres_dict.items()} # createa a reverse look-up dictionary
-                movies = discover_movie(genre_name, release_year, duration, actor_name)
-
-                if movies:
-                    for movie in movies.nodes(data=True):
-                        title = movie[0]
-                        details = movie[1]
-                        release_year = details.get('release_year', 'Unknown')
-                        duration = details.get('duration', 'Unknown')
-                        genre_names = ', '.join(
-                            [genre_dict.get(category) for category in details['category'] if category in genre_dict])
-
-                        actors = ', '.join(details['actor'])
-                        poster_url = get_movie_image_url(TMDB_API_KEY,title)
-                        response = requests.get(poster_url)
-                        image = io.BytesIO(response.content)
-                        image.name = "movie_poster.jpg"
-
-                        details_str = f"Release Year: {release_year}\nDuration: {duration}\nGenres: {genre_names}\nActors: {actors}"
-                        await update.message.reply_photo(photo=image, caption=details_str)
-                else:
-                    response = 'No movies found.'
+                # Fetch movies and their posters in the background, replacing any older search
+                message = update.message
+                search_manager.submit(
+                    user_id,
+                    lambda cancel_event: send_search_results(message, genre_name, release_year, actor_name, duration, cancel_event),
+                    on_timeout=lambda: scheduler.send_text(message.chat.id, 'The search took too long, please try again.'),
+                    on_error=lambda: scheduler.send_text(message.chat.id, 'Something went wrong with the search, please try again.'))
 
             else:
                 response = 'I don\'t understand'
 
     # Reply normally if the message is in private
     print('Bot:', response)
-    await update.message.reply_text(response)
+    if response:
+        scheduler.send_text(update.message.chat.id, response)
+
+# use the /stats command (moderators only)
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not db.db_check_user_mod(update.message.chat.id):
+        return
+
+    stats = '\n'.join(f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}"
+                       for name, value in scheduler.metrics().items())
+    scheduler.send_text(update.message.chat.id, stats)
+
+# start the outbound scheduler once the application's event loop runs
+async def start_scheduler(application: Application):
+    scheduler.start(application.bot)
+
+# stop the outbound scheduler when the application shuts down
+async def stop_scheduler(application: Application):
+    await scheduler.stop()
 
 # Log errors
 async def error(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -490,7 +499,7 @@ async def error(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # Run the program
 if __name__ == '__main__':
-    app = Application.builder().token(TOKEN).build()
+    app = Application.builder().token(TOKEN).post_init(start_scheduler).post_shutdown(stop_scheduler).build()
 
     # Commands
     app.add_handler(CommandHandler('start', start_command))
@@ -499,6 +508,7 @@ if __name__ == '__main__':
     app.add_handler(CommandHandler('history', History_command))
     app.add_handler(CommandHandler('upcoming', UpComing_command))
     app.add_handler(CommandHandler('topmovies', topmovies_command))
+    app.add_handler(CommandHandler('stats', stats_command))
      # app.add_handler(MessageHandler(filters.TEXT, rate_movie_number))
     # Messages
     app.add_handler(MessageHandler(filters.TEXT, handle_message))
@@ -506,6 +516,17 @@ if __name__ == '__main__':
     # Log all errors
     app.add_error_handler(error)
 
+    # Jobs (the job queue needs the python-telegram-bot[job-queue] extra)
+    if app.job_queue is None:
+        raise SystemExit('The job queue is missing, install it with: pip install "python-telegram-bot[job-queue]"')
+
+    app.job_queue.run_repeating(compact_history_job, interval=24 * 60 * 60, first=60)
+    app.job_queue.run_daily(prewarm_job, time=PREWARM_TIME)
+    app.job_queue.run_repeating(save_cast_graph_job, interval=CAST_GRAPH_SAVE_INTERVAL, first=CAST_GRAPH_SAVE_INTERVAL)
+
     print('Polling...')
     # Run the bot
     app.run_polling(poll_interval=5)
+
+    # Keep the credits fetched since the last periodic save
+    cast_graph.save()
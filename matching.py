@@ -0,0 +1,253 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import networkx as nx
+
+from cache import TTLCache
+from cast_graph import cast_graph
+from utils import get_actor_id, get_film_actors, get_film_runtime, create_genre_dictionary, film_runtime_cache, tmdb_session
+from secret import TMDB_API_KEY
+
+# createa a genres dictionary with genre name and its integer value
+genres_dict = create_genre_dictionary()
+
+# reverse look-up dictionary: genre name by genre id
+genre_names = {v: k for k, v in genres_dict.items()}
+
+# genre id by lower-case genre name, for genres typed by users
+genre_ids_by_name = {k.lower(): v for k, v in genres_dict.items()}
+
+# discover results by search parameters, filled by searches and by the prewarmer;
+# kept a little over a day so the daily prewarm refreshes them before they expire
+DISCOVER_CACHE_TTL = 25 * 60 * 60
+discover_cache = TTLCache(DISCOVER_CACHE_TTL, maxsize=512)
+
+# number of movies a search returns
+NUMBER_OF_FILMS_TO_ADD = 10
+
+DISCOVER_URL = "https://api.themoviedb.org/3/discover/movie"
+
+# how far the relaxed queries widen the year (in years) and the runtime (in minutes)
+YEAR_SLACKS = (1, 3)
+RUNTIME_SLACK = 20
+
+# method to calculate similarity between movies based on genres, release year, cast and duration
+def calculate_similarity(target_params, movie_params):
+
+    """
+    Count how many of the searched constraints a movie satisfies.
+
+    :param target_params: The searched (genre id, release year, actor id, duration); None means any.
+    :param movie_params: The movie's (set of genre ids, release year, set of actor ids, runtime);
+        the runtime is a known lower bound of it, or None if unknown.
+    :return: The number of satisfied constraints, from 0 to 4.
+    """
+
+    genre_id, release_year, actor_id, duration = target_params
+    genre_ids, movie_year, actor_ids, runtime = movie_params
+
+    similarity_score = 0
+    similarity_score += genre_id is None or genre_id in genre_ids
+    similarity_score += release_year is None or movie_year == release_year
+    similarity_score += actor_id is None or actor_id in actor_ids
+    similarity_score += duration is None or (runtime is not None and runtime >= duration)
+
+    return similarity_score
+
+# Method to turn a typed number (year, minutes) into an int
+def parse_number(value):
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+# Method to build the strict query and its relaxed variants
+def plan_queries(genre_id, release_year, actor_id, duration):
+
+    """
+    Build the TMDB discover parameters of the strict query and of the relaxed
+    variants tried when it has too few results: the year widened by every
+    YEAR_SLACKS step, the runtime widened by RUNTIME_SLACK, the actor dropped,
+    and all of these at once. Variants equal to an earlier one are skipped.
+
+    :return: (params, known) pairs, strict query first. known tells which
+        constraints every movie returned by the query satisfies.
+    """
+
+    def params(year_slack=0, runtime_slack=0, with_actor=True):
+        query = {
+            "with_genres": genre_id,
+            "with_cast": actor_id if with_actor else None,
+            "runtime.gte": duration - runtime_slack if duration is not None else None,
+        }
+
+        if release_year is not None and year_slack:
+            query["primary_release_date.gte"] = f"{release_year - year_slack}-01-01"
+            query["primary_release_date.lte"] = f"{release_year + year_slack}-12-31"
+        else:
+            query["primary_release_year"] = release_year
+
+        known = {
+            'actor': with_actor and actor_id is not None,
+            'duration': runtime_slack == 0 and duration is not None,
+        }
+        return query, known
+
+    variants = [params()]
+    variants += [params(year_slack=slack) for slack in YEAR_SLACKS]
+    variants.append(params(runtime_slack=RUNTIME_SLACK))
+    variants.append(params(with_actor=False))
+    variants.append(params(year_slack=YEAR_SLACKS[-1], runtime_slack=RUNTIME_SLACK, with_actor=False))
+
+    planned = []
+    for variant in variants:
+        if variant not in planned:
+            planned.append(variant)
+
+    return planned
+
+# Method to fetch one page of a discover query
+def fetch_discover_page(query, page=1):
+
+    """
+    Fetch a page of TMDB discover results, most popular first.
+
+    :param query: The discover filters.
+    :param page: The page to fetch.
+    :return: The response data, or None if the request failed.
+    """
+
+    params = {
+        "api_key": TMDB_API_KEY,
+        "sort_by": "popularity.desc",
+        "include_adult": False,
+        "include_video": False,
+        "page": page,
+        **{key: value for key, value in query.items() if value is not None}
+    }
+
+    response = tmdb_session.get(DISCOVER_URL, params=params)
+
+    if response.status_code == 200:
+        return response.json()
+
+    print(f"Error fetching data from API - {response.status_code}")
+    print(response.text)
+    return None
+
+# Method to discover movies based on user-defined parameters
+def discover_movie(genre_name=None, release_year=None, actor_name=None, duration=None, cancel_event=None, refresh=False):
+
+    """
+    Discover movies based on user-defined parameters.
+
+    The strict query is sent first; its total_results tells whether it can
+    fill the result on its own. If not, the relaxed variants from
+    plan_queries are sent in parallel, merged by movie id and ranked by how
+    many of the searched constraints each movie satisfies.
+
+    :param genre_name: The genre of the movie.
+    :param release_year: The release year of the movie.
+    :param actor_name: The actor's name in the movie.
+    :param duration: The duration of the movie.
+    :param cancel_event: Optional threading.Event; once set no more requests are made.
+    :param refresh: Query TMDB even if the result is cached, renewing the cache entry.
+    :return: A network graph containing movie information.
+    """
+
+    # searches typed by users and the ones logged in the db share one cache entry
+    cache_key = tuple(None if value is None else str(value).strip().lower()
+                      for value in (genre_name, release_year, actor_name, duration))
+    filmGraph = None if refresh else discover_cache.get(cache_key)
+    if filmGraph is not None:
+        return filmGraph
+
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    # Initialize a network graph to store movie information
+    filmGraph = nx.Graph()
+    if cancelled():
+        return filmGraph
+
+    actor_id = get_actor_id(actor_name) if actor_name is not None else None
+    genre_id = genre_ids_by_name.get(genre_name.strip().lower()) if genre_name is not None else None
+    release_year = parse_number(release_year)
+    duration = parse_number(duration)
+
+    queries = plan_queries(genre_id, release_year, actor_id, duration)
+
+    # Estimate the result size from the strict query's first page
+    if cancelled():
+        return filmGraph
+
+    strict = fetch_discover_page(queries[0][0])
+    if strict is None or cancelled():
+        return filmGraph
+
+    results = [(queries[0][1], strict["results"])]
+
+    if strict["total_results"] < NUMBER_OF_FILMS_TO_ADD and len(queries) > 1:
+        relaxed = queries[1:]
+        # each query runs in a copy of the caller's context, so a TMDB throttle set by the caller applies
+        with ThreadPoolExecutor(max_workers=len(relaxed)) as executor:
+            futures = [executor.submit(contextvars.copy_context().run,
+                                       lambda query: None if cancelled() else fetch_discover_page(query), query)
+                       for query, known in relaxed]
+            pages = [future.result() for future in futures]
+
+        results += [(known, page["results"]) for (query, known), page in zip(relaxed, pages) if page is not None]
+
+    # Merge the queries' movies by id, remembering what each query guarantees
+    candidates = {}
+    for known, movies in results:
+        for movie in movies:
+            candidate = candidates.setdefault(movie['id'], {'movie': movie, 'actor': False, 'duration': False})
+            candidate['actor'] = candidate['actor'] or known['actor']
+            candidate['duration'] = candidate['duration'] or known['duration']
+
+    target_params = (genre_id, release_year, actor_id, duration)
+
+    def rank(candidate):
+        movie = candidate['movie']
+        movie_year = parse_number(movie.get('release_date', '')[:4])
+
+        actor_ids = set(cast_graph.actors_for_movie(movie['id']))
+        if candidate['actor']:
+            actor_ids.add(actor_id)
+
+        runtime = duration if candidate['duration'] else film_runtime_cache.get((movie['id'],))
+        movie_params = (set(movie['genre_ids']), movie_year, actor_ids, runtime)
+
+        year_distance = abs(movie_year - release_year) if movie_year is not None and release_year is not None else 0
+        return (-calculate_similarity(target_params, movie_params), year_distance, -movie.get('popularity', 0))
+
+    ranked = sorted(candidates.values(), key=rank)[:NUMBER_OF_FILMS_TO_ADD]
+
+    # Hydrate the chosen movies and add them to the graph
+    for candidate in ranked:
+        if cancelled():
+            return filmGraph
+
+        movie = candidate['movie']
+        film_id = movie['id']
+        film_runtime = get_film_runtime(film_id) or 0
+        duration_formatted = f"{film_runtime // 60}h {film_runtime % 60}m"
+
+        if cancelled():
+            return filmGraph
+
+        filmGraph.add_node(
+            movie['title'],
+            movie_id=film_id,
+            poster_path=movie.get('poster_path'),
+            category=movie['genre_ids'],
+            release_year=movie.get('release_date', '')[:4],
+            duration=duration_formatted,
+            actor=get_film_actors(film_id)
+        )
+
+    if filmGraph:
+        discover_cache.set(cache_key, filmGraph)
+
+    return filmGraph
@@ -0,0 +1,144 @@
+from functools import lru_cache
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from cache import TTLCache
+
+# Telegram limits for a text message and for a photo caption
+MESSAGE_LIMIT = 4096
+CAPTION_LIMIT = 1024
+
+# movies shown on one page of a movie list
+PAGE_SIZE = 5
+
+# rendered text per movie id, kept as long as the cached movie data
+RENDER_CACHE_TTL = 24 * 60 * 60
+collage_line_cache = TTLCache(RENDER_CACHE_TTL, maxsize=4096)
+list_entry_cache = TTLCache(RENDER_CACHE_TTL, maxsize=4096)
+
+# The keyboard shown by /start, built once
+START_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Upcoming", callback_data="upcoming")],
+    [InlineKeyboardButton("Top Movies", callback_data="topmovies")],
+    [InlineKeyboardButton("History", callback_data="history")],
+    [InlineKeyboardButton("Random Movies", callback_data="randommovies")],
+    [InlineKeyboardButton("Rate Movies", callback_data="ratemovies")],
+    [InlineKeyboardButton("Search Movie", callback_data="searchmovie")]
+])
+
+# Method to render one movie of a movie list
+def render_list_entry(movie):
+
+    """
+    Render a movie of the upcoming/top rated lists, once per movie.
+    Args:
+        movie (dict): The movie's id, title, genres, release_year, duration and actors.
+    Returns:
+        str: The rendered entry.
+    """
+
+    entry = list_entry_cache.get(movie['id'])
+    if entry is None:
+        entry = (f"{movie['title']} ({movie['release_year']})\n"
+                 f"Genres: {', '.join(movie['genres'])}\n"
+                 f"Duration: {movie['duration']}\n"
+                 f"Actors: {', '.join(movie['actors'])}")
+        list_entry_cache.set(movie['id'], entry)
+
+    return entry
+
+# Method to split a movie list into Telegram sized pages
+def render_movie_list_pages(movies, page_size=PAGE_SIZE):
+
+    """
+    Render a movie list into numbered pages of at most page_size movies,
+    starting a new page early if a page would go over the message limit.
+    Args:
+        movies (list): The movies, as returned by get_movies_by_options.
+        page_size (int): Maximum number of movies on a page.
+    Returns:
+        list: The text of every page, at least one.
+    """
+
+    pages = []
+    page = []
+    page_length = 0
+
+    for number, movie in enumerate(movies, start=1):
+        entry = f"{number}. {render_list_entry(movie)}"[:MESSAGE_LIMIT]
+
+        if page and (len(page) == page_size or page_length + len(entry) + 2 > MESSAGE_LIMIT):
+            pages.append('\n\n'.join(page))
+            page = []
+            page_length = 0
+
+        page.append(entry)
+        page_length += len(entry) + 2
+
+    if page:
+        pages.append('\n\n'.join(page))
+
+    return pages or ['No movies found.']
+
+# Method to build the prev/next buttons of a movie list page
+@lru_cache(maxsize=256)
+def page_keyboard(list_name, page, page_count):
+
+    """
+    Build the navigation keyboard of a page. Callback data has the form
+    "page:<list_name>:<page>".
+    Args:
+        list_name (str): The list being paged, e.g. 'top_rated'.
+        page (int): The page shown, starting at 0.
+        page_count (int): Number of pages in the list.
+    Returns:
+        InlineKeyboardMarkup: The keyboard, or None for a single page list.
+    """
+
+    buttons = []
+
+    if page > 0:
+        buttons.append(InlineKeyboardButton("« Prev", callback_data=f"page:{list_name}:{page - 1}"))
+    if page < page_count - 1:
+        buttons.append(InlineKeyboardButton("Next »", callback_data=f"page:{list_name}:{page + 1}"))
+
+    if not buttons:
+        return None
+
+    return InlineKeyboardMarkup([buttons])
+
+# Method to render a movie's line of a collage caption
+def render_collage_line(title, details):
+
+    """
+    Render a movie's line of a collage caption, once per movie.
+    Args:
+        title (str): The movie's title.
+        details (dict): The movie's movie_id, release_year and duration.
+    Returns:
+        str: The rendered line, without its number.
+    """
+
+    movie_id = details.get('movie_id', title)
+    line = collage_line_cache.get(movie_id)
+    if line is None:
+        line = f"{title} ({details.get('release_year', '?')}, {details.get('duration', '?')})"
+        collage_line_cache.set(movie_id, line)
+
+    return line
+
+# Method to render the compact caption of a poster collage
+def render_collage_caption(movies):
+
+    """
+    Render one numbered line per movie, matching the tiles of the collage.
+    Args:
+        movies (list): (title, details) pairs in result order.
+    Returns:
+        str: The caption, cut to Telegram's caption limit.
+    """
+
+    lines = [f"{number}. {render_collage_line(title, details)}"
+             for number, (title, details) in enumerate(movies, start=1)]
+
+    return '\n'.join(lines)[:CAPTION_LIMIT]
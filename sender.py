@@ -0,0 +1,413 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from telegram.error import RetryAfter
+
+from render import MESSAGE_LIMIT
+
+# send priorities, lower is sent first
+INTERACTIVE = 0
+BULK = 1
+
+# Telegram allows about 30 messages a second overall and 1 a second per chat
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+
+# sends waiting for Telegram at the same time (never more than one per chat)
+MAX_IN_FLIGHT = 8
+
+# seconds between drops of idle chats' buckets, and seconds stop() lets sends finish
+BUCKET_PRUNE_INTERVAL = 60
+STOP_TIMEOUT = 5
+
+# Token bucket used to space out sends
+class TokenBucket:
+
+    """
+    A token bucket refilled at a steady rate.
+    Args:
+        rate (float): Tokens added per second.
+        capacity (int): Maximum number of stored tokens (the burst size).
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def delay(self):
+
+        """
+        Get how long until a token is available.
+        Returns:
+            float: Seconds to wait, 0 if a token can be taken now.
+        """
+
+        now = self.refill()
+
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    def full(self):
+        return self.refill() >= self.paused_until and self.tokens >= self.capacity
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+# A message waiting in the scheduler
+class OutboundMessage:
+
+    def __init__(self, chat_id, kind, payload, priority, tag=None):
+        self.tag = tag
+        self.chat_id = chat_id
+        self.kind = kind
+        self.payload = payload
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+# Sends bot messages within Telegram's flood limits
+class OutboundScheduler:
+
+    """
+    Queue outgoing messages and send them within Telegram's global and
+    per-chat limits.
+
+    Interactive replies are sent before bulk sends. Chats with waiting
+    messages take turns, and each chat has one send in flight at a time so
+    its messages keep their order. Consecutive plain texts queued for the
+    same chat are joined into one message. A RetryAfter from Telegram pauses
+    sending for the time it asks for, then the messages are retried.
+
+    Args:
+        global_rate (float): Messages per second over all chats.
+        chat_rate (float): Messages per second to a single chat.
+        chat_burst (int): Messages a chat may get at once before chat_rate applies.
+        max_in_flight (int): Sends waiting for Telegram at the same time.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, max_in_flight=MAX_IN_FLIGHT):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_in_flight = max_in_flight
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._queues = {INTERACTIVE: OrderedDict(), BULK: OrderedDict()}
+        self._busy_chats = set()
+        self._sending = set()
+        self._next_prune = 0
+        self._wakeup = None
+        self._worker = None
+        self._bot = None
+
+        self._stats = {'sent': 0, 'coalesced': 0, 'retries': 0, 'failed': 0, 'discarded': 0}
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def start(self, bot):
+
+        """
+        Start the sending task; call from within the running event loop.
+        Args:
+            bot (telegram.Bot): The bot to send with.
+        """
+
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=STOP_TIMEOUT):
+
+        """
+        Stop the sending task. Sends already in progress get up to timeout
+        seconds to finish; the messages still queued after that are dropped
+        and their futures resolve to None.
+        Args:
+            timeout (float): Seconds to wait for the sends in progress.
+        """
+
+        if self._worker is None:
+            return
+
+        self._worker.cancel()
+        self._worker = None
+
+        if self._sending:
+            done, pending = await asyncio.wait(self._sending, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+
+        dropped = 0
+        for chats in self._queues.values():
+            for messages in chats.values():
+                for message in messages:
+                    if not message.future.done():
+                        message.future.set_result(None)
+                dropped += len(messages)
+            chats.clear()
+
+        if dropped:
+            print(f'Dropped {dropped} unsent messages on shutdown')
+
+    def send_text(self, chat_id, text, priority=INTERACTIVE, reply_markup=None, tag=None):
+
+        """
+        Queue a text message.
+        Args:
+            chat_id (int): The chat to send to.
+            text (str): The message text.
+            priority (int): INTERACTIVE or BULK.
+            reply_markup: Optional keyboard; messages with one are never coalesced.
+            tag (str): Optional label that discard() can drop queued messages by.
+        Returns:
+            asyncio.Future: Resolves to the sent Message, or None if sending failed.
+        """
+
+        return self._enqueue(OutboundMessage(chat_id, 'text', {'text': text, 'reply_markup': reply_markup}, priority, tag))
+
+    def send_photo(self, chat_id, photo, caption=None, priority=INTERACTIVE, tag=None):
+
+        """
+        Queue a photo.
+        Args:
+            chat_id (int): The chat to send to.
+            photo: The photo, as a file-like object, file id or URL.
+            caption (str): Optional caption.
+            priority (int): INTERACTIVE or BULK.
+            tag (str): Optional label that discard() can drop queued messages by.
+        Returns:
+            asyncio.Future: Resolves to the sent Message, or None if sending failed.
+        """
+
+        return self._enqueue(OutboundMessage(chat_id, 'photo', {'photo': photo, 'caption': caption}, priority, tag))
+
+    def discard(self, chat_id, tag):
+
+        """
+        Drop the chat's queued messages with a tag; messages already being
+        sent are not affected. Their futures resolve to None.
+        Args:
+            chat_id (int): The chat whose messages are dropped.
+            tag (str): The tag given when the messages were queued.
+        Returns:
+            int: The number of dropped messages.
+        """
+
+        dropped = 0
+
+        for chats in self._queues.values():
+            messages = chats.get(chat_id)
+            if not messages:
+                continue
+
+            kept = deque()
+            for message in messages:
+                if message.tag == tag:
+                    dropped += 1
+                    if not message.future.done():
+                        message.future.set_result(None)
+                else:
+                    kept.append(message)
+
+            if kept:
+                chats[chat_id] = kept
+            else:
+                del chats[chat_id]
+
+        self._stats['discarded'] += dropped
+        return dropped
+
+    def metrics(self):
+
+        """
+        Get the scheduler's queue and latency metrics.
+        Returns:
+            dict: Queue depth (total and per priority), sends in flight, counts
+                of sent, coalesced, retried and failed messages, and the
+                average and maximum seconds from queueing to delivery.
+        """
+
+        depth = {priority: sum(len(messages) for messages in chats.values())
+                 for priority, chats in self._queues.items()}
+        sent = self._stats['sent']
+
+        return {
+            'queue_depth': sum(depth.values()),
+            'queue_depth_interactive': depth[INTERACTIVE],
+            'queue_depth_bulk': depth[BULK],
+            'in_flight': len(self._busy_chats),
+            **self._stats,
+            'avg_send_latency': self._latency_total / sent if sent else 0.0,
+            'max_send_latency': self._latency_max,
+        }
+
+    def _enqueue(self, message):
+        self._queues[message.priority].setdefault(message.chat_id, deque()).append(message)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return message.future
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _prune_buckets(self):
+
+        # an idle chat with a full bucket would get the same fresh bucket back
+        queued = set().union(*self._queues.values())
+
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if chat_id not in queued and chat_id not in self._busy_chats and bucket.full():
+                del self._chat_buckets[chat_id]
+
+    def _pick(self):
+
+        # the highest priority chat that is idle and within its limit, chats taking turns
+        wait = None
+
+        for priority in sorted(self._queues):
+            chats = self._queues[priority]
+
+            for chat_id in list(chats):
+                if chat_id in self._busy_chats:
+                    continue
+
+                delay = self._chat_bucket(chat_id).delay()
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+
+                chats.move_to_end(chat_id)
+                return self._take_batch(chats, chat_id), None
+
+        return None, wait
+
+    def _take_batch(self, chats, chat_id):
+        messages = chats[chat_id]
+        batch = [messages.popleft()]
+
+        # join the plain texts queued right after each other into one message
+        if batch[0].kind == 'text' and batch[0].payload['reply_markup'] is None:
+            length = len(batch[0].payload['text'])
+
+            while messages and messages[0].kind == 'text' and messages[0].payload['reply_markup'] is None \
+                    and length + 2 + len(messages[0].payload['text']) <= MESSAGE_LIMIT:
+                length += 2 + len(messages[0].payload['text'])
+                batch.append(messages.popleft())
+
+        if not messages:
+            del chats[chat_id]
+
+        return batch
+
+    async def _run(self):
+        while True:
+            if time.monotonic() >= self._next_prune:
+                self._prune_buckets()
+                self._next_prune = time.monotonic() + BUCKET_PRUNE_INTERVAL
+
+            delay = self._global.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            await self._in_flight.acquire()
+            batch, wait = self._pick()
+
+            if batch is None:
+                self._in_flight.release()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._global.take()
+            self._chat_bucket(batch[0].chat_id).take()
+            self._busy_chats.add(batch[0].chat_id)
+
+            task = asyncio.create_task(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch):
+        chat_id = batch[0].chat_id
+
+        try:
+            message = await self._deliver(batch)
+
+        except RetryAfter as e:
+            # Telegram asked us to slow down: pause all sends and retry this batch first
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            print(f'Flood limit hit, pausing sends for {retry_after}s')
+            self._global.pause(retry_after)
+            self._stats['retries'] += 1
+
+            chats = self._queues[batch[0].priority]
+            chats.setdefault(chat_id, deque()).extendleft(reversed(batch))
+            chats.move_to_end(chat_id, last=False)
+
+        except asyncio.CancelledError:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_result(None)
+            raise
+
+        except Exception as e:
+            print(f'Failed to send to chat {chat_id}: {e}')
+            self._stats['failed'] += len(batch)
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_result(None)
+
+        else:
+            now = time.monotonic()
+            self._stats['sent'] += len(batch)
+            self._stats['coalesced'] += len(batch) - 1
+
+            for item in batch:
+                latency = now - item.enqueued
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+                if not item.future.done():
+                    item.future.set_result(message)
+
+        finally:
+            self._busy_chats.discard(chat_id)
+            self._in_flight.release()
+            self._wakeup.set()
+
+    async def _deliver(self, batch):
+        first = batch[0]
+
+        if first.kind == 'photo':
+            photo = first.payload['photo']
+            if hasattr(photo, 'seek'):
+                photo.seek(0)
+            return await self._bot.send_photo(first.chat_id, photo=photo, caption=first.payload['caption'])
+
+        text = '\n\n'.join(item.payload['text'] for item in batch)
+        return await self._bot.send_message(first.chat_id, text, reply_markup=first.payload['reply_markup'])
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import traceback
+
+# at most this many searches run at once, across all users
+MAX_CONCURRENT_SEARCHES = 4
+
+# seconds a single search may take once it started running
+SEARCH_DEADLINE = 90
+
+# Keeps at most one running search per chat and caps searches globally
+class SearchTaskManager:
+
+    """
+    Run searches as background tasks, one per chat at a time.
+
+    Submitting a search for a chat cancels the chat's previous search. Running
+    searches share a global cap; since every chat has at most one waiting or
+    running search and the semaphore wakes waiters in FIFO order, queued chats
+    are served in turn and one heavy user can't starve the others.
+
+    Args:
+        max_concurrent (int): How many searches may run at once.
+        deadline (int): Seconds a search may run before it is cancelled.
+        on_cancel (callable): Optional function called with the chat id whenever
+            the chat's searches are cancelled, e.g. to drop their queued replies.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_SEARCHES, deadline=SEARCH_DEADLINE, on_cancel=None):
+        self.deadline = deadline
+        self.on_cancel = on_cancel
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._tasks = {}
+
+    def submit(self, chat_id, search, on_timeout=None, on_error=None):
+
+        """
+        Start a search for a chat, cancelling the chat's older search.
+        Args:
+            chat_id (int): The chat the search belongs to.
+            search (callable): Called with a threading.Event that is set once the
+                search is cancelled; returns the coroutine to run. Blocking code
+                run in threads should check the event between requests.
+            on_timeout (callable): Optional coroutine function awaited when the
+                search misses its deadline.
+            on_error (callable): Optional coroutine function awaited when the
+                search fails with an error, after the error is logged.
+        Returns:
+            asyncio.Task: The task running the search.
+        """
+
+        self.cancel(chat_id)
+
+        cancel_event = threading.Event()
+        task = asyncio.create_task(self._run(chat_id, search, cancel_event, on_timeout, on_error))
+        self._tasks[chat_id] = (task, cancel_event)
+        return task
+
+    def cancel(self, chat_id):
+
+        """
+        Cancel the chat's search, if one is waiting or running, and let
+        on_cancel drop what earlier searches of the chat still have queued.
+        Args:
+            chat_id (int): The chat whose search is cancelled.
+        Returns:
+            bool: True if a search was cancelled.
+        """
+
+        if self.on_cancel is not None:
+            self.on_cancel(chat_id)
+
+        entry = self._tasks.pop(chat_id, None)
+        if entry is None:
+            return False
+
+        task, cancel_event = entry
+        cancel_event.set()
+        task.cancel()
+        return True
+
+    async def _run(self, chat_id, search, cancel_event, on_timeout, on_error):
+        try:
+            async with self._slots:
+                await asyncio.wait_for(search(cancel_event), self.deadline)
+
+        except asyncio.TimeoutError:
+            cancel_event.set()
+            print(f'Search for chat {chat_id} missed its {self.deadline}s deadline')
+            if on_timeout is not None:
+                await on_timeout()
+
+        except asyncio.CancelledError:
+            cancel_event.set()
+            raise
+
+        except Exception as e:
+            cancel_event.set()
+            print(f'Search for chat {chat_id} failed: {e!r}')
+            traceback.print_exception(e)
+            if on_error is not None:
+                await on_error()
+
+        finally:
+            entry = self._tasks.get(chat_id)
+            if entry is not None and entry[0] is asyncio.current_task():
+                del self._tasks[chat_id]
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+
+from cast_graph import CastGraph
+
+
+def credits(*actor_ids):
+    return [{'id': actor_id, 'name': f"Actor {actor_id}"} for actor_id in actor_ids]
+
+
+def current_generation(directory):
+    with open(os.path.join(directory, 'CURRENT')) as f:
+        return f.read()
+
+
+def test_save_readd_save_reload_round_trip(tmp_path):
+    directory = str(tmp_path / 'cast_graph')
+
+    graph = CastGraph(directory)
+    graph.add_credits(1, credits(30, 10, 20))
+    graph.add_credits(2, credits(10))
+    assert graph.save()
+
+    # movie 1 re-added with a new cast: actor 10 and 20 dropped, 40 billed first
+    graph.add_credits(1, credits(40, 30))
+    assert graph.save()
+
+    reloaded = CastGraph(directory)
+
+    assert reloaded.actors_for_movie(1) == [40, 30]
+    assert reloaded.actors_for_movie(2) == [10]
+    assert reloaded.movies_for_actor(10) == {2}
+    assert reloaded.movies_for_actor(20) == set()
+    assert reloaded.movies_for_actor(30) == {1}
+    assert reloaded.names([40]) == ['Actor 40']
+    assert [entry for entry in os.listdir(directory) if entry.startswith('gen-')] == [current_generation(directory)]
+
+
+def test_inconsistent_arrays_load_empty(tmp_path):
+    directory = str(tmp_path / 'cast_graph')
+
+    graph = CastGraph(directory)
+    graph.add_credits(1, credits(10, 20))
+    graph.save()
+
+    # movie ids of a newer save next to the older indptr
+    generation = os.path.join(directory, current_generation(directory))
+    np.save(os.path.join(generation, 'movie_ids.npy'), np.array([1, 2, 3], dtype=np.int64))
+
+    reloaded = CastGraph(directory)
+
+    assert reloaded.actors_for_movie(1) == []
+    assert reloaded.movies_for_actor(10) == set()
@@ -0,0 +1,55 @@
+import db
+
+
+def test_repeated_search_with_typed_numbers_is_deduplicated(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db.db_create_tables()
+    db.db_add_user(1)
+
+    first_id = db.db_add_recent_search(1, 'Action', '2010', '120', 'Tom Hanks')
+    second_id = db.db_add_recent_search(1, 'Action', '2010', '120', 'Tom Hanks')
+
+    assert first_id == second_id
+    assert len(db.get_user_recent_searches(1)) == 1
+    assert db.get_user_search_summary(1) == ([('Action', 1)], [('Tom Hanks', 1)])
+
+
+def test_different_search_is_kept(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db.db_create_tables()
+    db.db_add_user(1)
+
+    db.db_add_recent_search(1, 'Action', '2010', '120', 'Tom Hanks')
+    db.db_add_recent_search(1, 'Action', '2011', '120', 'Tom Hanks')
+
+    assert len(db.get_user_recent_searches(1)) == 2
+    assert db.get_user_search_summary(1)[0] == [('Action', 2)]
+
+
+def test_search_case_is_normalized(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db.db_create_tables()
+    db.db_add_user(1)
+
+    first_id = db.db_add_recent_search(1, 'action', '2010', '120', 'tom  hanks')
+    second_id = db.db_add_recent_search(1, 'Action', '2010', '120', 'Tom Hanks')
+
+    assert first_id == second_id
+    assert db.get_user_search_summary(1) == ([('Action', 1)], [('Tom Hanks', 1)])
+
+
+def test_purge_users_past_the_parameter_limit(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db.db_create_tables()
+    db.db_add_user(1, moderator=True)
+    db.db_add_user(2)
+    db.db_add_user(3)
+    db.db_add_recent_search(2, 'Action', '2010', '120', 'Tom Hanks')
+
+    # far more ids than SQLite accepts as bound parameters in one statement
+    purged = db.db_purge_users(1, [2, *range(100, 40100)])
+
+    assert purged == 1
+    assert db.db_user_exists(3)
+    assert db.get_user_recent_searches(2) == []
+    assert db.get_user_search_summary(2) == ([], [])
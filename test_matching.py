@@ -0,0 +1,68 @@
+import pytest
+
+# matching reads the TMDB key from the untracked secret.py and loads the genres on import
+matching = pytest.importorskip('matching')
+
+from cache import TTLCache
+from cast_graph import CastGraph
+
+
+def test_plan_queries_strict_first_with_known_flags():
+    queries = matching.plan_queries(28, 2010, 5, 120)
+
+    strict, strict_known = queries[0]
+    assert strict == {'with_genres': 28, 'with_cast': 5, 'runtime.gte': 120, 'primary_release_year': 2010}
+    assert strict_known == {'actor': True, 'duration': True}
+
+    assert len(queries) == 6
+    assert ({'with_genres': 28, 'with_cast': 5, 'runtime.gte': 100, 'primary_release_year': 2010},
+            {'actor': True, 'duration': False}) in queries
+    assert ({'with_genres': 28, 'with_cast': None, 'runtime.gte': 120, 'primary_release_year': 2010},
+            {'actor': False, 'duration': True}) in queries
+
+
+def test_plan_queries_skips_variants_equal_to_an_earlier_one():
+    # without a year or runtime the year and runtime variants are the strict query again
+    assert matching.plan_queries(28, None, None, None) == [
+        ({'with_genres': 28, 'with_cast': None, 'runtime.gte': None, 'primary_release_year': None},
+         {'actor': False, 'duration': False}),
+    ]
+
+    queries = matching.plan_queries(None, None, 5, None)
+    assert [query['with_cast'] for query, known in queries] == [5, None]
+
+
+def test_calculate_similarity_counts_satisfied_constraints():
+    target = (28, 2010, 5, 120)
+
+    assert matching.calculate_similarity(target, ({28, 12}, 2010, {5}, 130)) == 4
+    assert matching.calculate_similarity(target, ({12}, 2011, set(), None)) == 0
+    assert matching.calculate_similarity(target, ({28}, 2010, {5}, None)) == 3
+    assert matching.calculate_similarity((None, None, None, None), (set(), None, set(), None)) == 4
+
+
+def test_discover_ranks_by_constraint_count_before_popularity(tmp_path, monkeypatch):
+    exact = {'id': 1, 'title': 'Exact', 'genre_ids': [28], 'release_date': '2010-05-01', 'popularity': 1}
+    year_off = {'id': 2, 'title': 'Year off', 'genre_ids': [28], 'release_date': '2011-05-01', 'popularity': 50}
+    no_actor = {'id': 3, 'title': 'No actor', 'genre_ids': [28], 'release_date': '2013-05-01', 'popularity': 100}
+
+    def fetch_discover_page(query, page=1):
+        if query.get('primary_release_year') == 2010 and query['with_cast'] == 5 and query['runtime.gte'] == 120:
+            return {'total_results': 1, 'results': [exact]}
+        if 'primary_release_date.gte' in query and query['with_cast'] == 5:
+            return {'total_results': 1, 'results': [year_off]}
+        if query['with_cast'] is None:
+            return {'total_results': 1, 'results': [no_actor]}
+        return {'total_results': 0, 'results': []}
+
+    monkeypatch.setattr(matching, 'fetch_discover_page', fetch_discover_page)
+    monkeypatch.setattr(matching, 'get_actor_id', lambda name: 5)
+    monkeypatch.setattr(matching, 'get_film_runtime', lambda film_id: 120)
+    monkeypatch.setattr(matching, 'get_film_actors', lambda film_id: [])
+    monkeypatch.setattr(matching, 'genre_ids_by_name', {'action': 28})
+    monkeypatch.setattr(matching, 'discover_cache', TTLCache(60))
+    monkeypatch.setattr(matching, 'cast_graph', CastGraph(str(tmp_path / 'cast_graph')))
+
+    movies = matching.discover_movie('Action', '2010', 'Someone', '120')
+
+    assert list(movies.nodes) == ['Exact', 'Year off', 'No actor']
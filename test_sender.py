@@ -0,0 +1,80 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+from render import MESSAGE_LIMIT
+from sender import BULK, OutboundScheduler
+
+
+class FakeBot:
+
+    def __init__(self, failures=()):
+        self.sent = []
+        self.failures = list(failures)
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.sent.append((chat_id, text))
+        return text
+
+
+def run_scheduler(queue, bot, **kwargs):
+
+    # queue messages before the worker starts, then wait for all of them
+    async def main():
+        scheduler = OutboundScheduler(global_rate=1000, chat_rate=1000, chat_burst=1000, **kwargs)
+        futures = queue(scheduler)
+        scheduler.start(bot)
+        results = await asyncio.wait_for(asyncio.gather(*futures), 5)
+        await scheduler.stop()
+        return scheduler, results
+
+    return asyncio.run(main())
+
+
+def test_texts_are_coalesced_up_to_the_message_limit():
+    bot = FakeBot()
+    half = 'x' * (MESSAGE_LIMIT // 2 - 10)
+
+    scheduler, results = run_scheduler(lambda s: [s.send_text(1, half) for _ in range(3)], bot)
+
+    assert bot.sent == [(1, f"{half}\n\n{half}"), (1, half)]
+    assert len(bot.sent[0][1]) <= MESSAGE_LIMIT
+    assert scheduler.metrics()['coalesced'] == 1
+
+
+def test_retry_after_requeues_the_batch():
+    bot = FakeBot(failures=[RetryAfter(0)])
+
+    scheduler, results = run_scheduler(lambda s: [s.send_text(1, 'first'), s.send_text(1, 'second', reply_markup=object())], bot)
+
+    assert bot.sent == [(1, 'first'), (1, 'second')]
+    assert results == ['first', 'second']
+    assert scheduler.metrics()['retries'] == 1
+
+
+def test_discard_drops_tagged_messages_only():
+    bot = FakeBot()
+
+    def queue(scheduler):
+        futures = [scheduler.send_text(1, 'old result', tag='search'), scheduler.send_text(1, 'reply')]
+        scheduler.discard(1, 'search')
+        return futures
+
+    scheduler, results = run_scheduler(queue, bot)
+
+    assert bot.sent == [(1, 'reply')]
+    assert results == [None, 'reply']
+    assert scheduler.metrics()['discarded'] == 1
+
+
+def test_interactive_messages_are_sent_before_bulk():
+    bot = FakeBot()
+
+    def queue(scheduler):
+        return [scheduler.send_text(1, 'bulk', priority=BULK), scheduler.send_text(2, 'interactive')]
+
+    run_scheduler(queue, bot, max_in_flight=1)
+
+    assert bot.sent == [(2, 'interactive'), (1, 'bulk')]
@@ -1,9 +1,64 @@
+import contextvars
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
 from secret import TOKEN
-from PIL import Image
-from io import BytesIO
+from cache import TTLCache, cached
+from cast_graph import cast_graph
+
+# TMDB lookups barely change, so their results are kept for a day
+LOOKUP_CACHE_TTL = 24 * 60 * 60
+
+actor_id_cache = TTLCache(LOOKUP_CACHE_TTL)
+movie_id_cache = TTLCache(LOOKUP_CACHE_TTL)
+movie_image_cache = TTLCache(LOOKUP_CACHE_TTL)
+film_runtime_cache = TTLCache(LOOKUP_CACHE_TTL, maxsize=4096)
+
+# Spaces out calls so that at most `rate` of them start per second
+class Throttle:
+
+    """
+    A thread-safe minimum-interval throttle.
+    Args:
+        rate (float): Calls allowed per second.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next_call = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_call)
+            self._next_call = start + self.interval
+
+        if start > now:
+            time.sleep(start - now)
+
+# throttle for the TMDB calls made in the current context, e.g. by the prewarmer;
+# None (the default) leaves interactive searches unthrottled
+tmdb_throttle = contextvars.ContextVar('tmdb_throttle', default=None)
+
+# Session that waits on the context's throttle before every request
+class TMDBSession(requests.Session):
+
+    def request(self, *args, **kwargs):
+        throttle = tmdb_throttle.get()
+        if throttle is not None:
+            throttle.wait()
+        return super().request(*args, **kwargs)
+
+# one pooled HTTP session for all TMDB calls, so parallel searches reuse connections
+TMDB_POOL_SIZE = 32
+tmdb_session = TMDBSession()
+tmdb_session.mount('https://', HTTPAdapter(pool_connections=TMDB_POOL_SIZE, pool_maxsize=TMDB_POOL_SIZE))
 
 # Method to get the ID of an actor using their name
+@cached(actor_id_cache)
 def get_actor_id(actor_name):
 
     """
@@ -14,7 +69,7 @@ def get_actor_id(actor_name):
         int: The actor's ID if found, otherwise None.
     """
         
-    actor_response = requests.get(f"https://api.themoviedb.org/3/search/person?api_key={TOKEN}&query={actor_name}")
+    actor_response = tmdb_session.get(f"https://api.themoviedb.org/3/search/person?api_key={TOKEN}&query={actor_name}")
     actor_data = actor_response.json()
 
     if actor_data['total_results'] == 0:
@@ -25,6 +80,7 @@ def get_actor_id(actor_name):
         return actor_id
 
 # Method to get the ID of a movie using its name
+@cached(movie_id_cache)
 def get_movie_id(movie_name):
 
     """
@@ -36,7 +92,7 @@ def get_movie_id(movie_name):
     """
 
     url = f"https://api.themoviedb.org/3/search/movie?api_key={TOKEN}&query={movie_name}"
-    response = requests.get(url)
+    response = tmdb_session.get(url)
 
     if(response.status_code == 200):
         data = response.json()
@@ -50,6 +106,7 @@ def get_movie_id(movie_name):
         print(f"Error retrieving movie information.\nResponse status code: {response.status_code}")
 
 # Method to get the URL of a movie's image
+@cached(movie_image_cache)
 def get_movie_image_url(api_key, movie_name):
 
     """
@@ -67,7 +124,7 @@ def get_movie_image_url(api_key, movie_name):
         "query": movie_name
     }
 
-    response = requests.get(base_url, params=params)
+    response = tmdb_session.get(base_url, params=params)
     data = response.json()
 
     if "results" in data and len(data["results"]) > 0:
@@ -80,7 +137,7 @@ def get_movie_image_url(api_key, movie_name):
             "api_key": api_key
         }
 
-        movie_response = requests.get(movie_details_url, params=params)
+        movie_response = tmdb_session.get(movie_details_url, params=params)
         movie_data = movie_response.json()
 
         if "poster_path" in movie_data:
@@ -90,6 +147,7 @@ def get_movie_image_url(api_key, movie_name):
     return None
 
 # Method to get the runtime of a film using its ID
+@cached(film_runtime_cache)
 def get_film_runtime(film_id):
 
     """
@@ -100,7 +158,7 @@ def get_film_runtime(film_id):
         int: The runtime of the film in minutes.
     """
         
-    response = requests.get(f"https://api.themoviedb.org/3/movie/{film_id}?api_key={TOKEN}&language=en-US")
+    response = tmdb_session.get(f"https://api.themoviedb.org/3/movie/{film_id}?api_key={TOKEN}&language=en-US")
     movie_details = response.json()
     runtime = movie_details['runtime']
     return runtime
@@ -109,21 +167,26 @@ def get_film_runtime(film_id):
 def get_film_actors(film_id):
 
     """
-    Get the actors of a film using its ID from The Movie Database (TMDb) API.
+    Get the actors of a film using its ID, from the cast graph if the film's
+    credits were fetched before, otherwise from The Movie Database (TMDb) API.
     Args:
         film_id (int): The ID of the film.
     Returns:
         list: A list of actor names (up to 2 actors).
     """
 
+    if cast_graph.has_movie(film_id):
+        return cast_graph.names(cast_graph.actors_for_movie(film_id)[:2])
+
     CAST_URL = f"https://api.themoviedb.org/3/movie/{film_id}/credits"
 
     params = {"api_key": TOKEN}
 
-    response = requests.get(CAST_URL, params=params)
+    response = tmdb_session.get(CAST_URL, params=params)
 
     if response.status_code == 200:
         cast = response.json()["cast"]
+        cast_graph.add_credits(film_id, cast)
         return [actor["name"] for actor in cast[:2]]
 
     return []
@@ -140,7 +203,7 @@ def get_movie_poster(movie_name):
     """
         
     movie_id = get_movie_id(movie_name)
-    response = requests.get(f"https://api.themoviedb.org/3/movie/{movie_id}/images?api_key={TOKEN}")
+    response = tmdb_session.get(f"https://api.themoviedb.org/3/movie/{movie_id}/images?api_key={TOKEN}")
 
     if response.status_code == 200:
         data = response.json()
@@ -161,7 +224,7 @@ def create_genre_dictionary():
         dict: A dictionary with genre names as keys and genre IDs as values.
     """
         
-    response = requests.get(f"https://api.themoviedb.org/3/genre/movie/list?api_key={TOKEN}")
+    response = tmdb_session.get(f"https://api.themoviedb.org/3/genre/movie/list?api_key={TOKEN}")
     genres = response.json()['genres']
 
     genres_dict = {genre["name"]: genre["id"] for genre in genres}